@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Birthday Club offline reports
+Streams the customers collection into a columnar Parquet/Arrow snapshot and
+computes reports from the snapshot with pandas, so heavy reporting never
+runs against the live database
+"""
+
+import os
+from datetime import date, datetime
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import typer
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+load_dotenv()
+
+# Same database as the API; reads default to a secondary when there is one
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+REPORTS_READ_PREFERENCE = os.getenv("REPORTS_READ_PREFERENCE", "secondaryPreferred")
+# Documents per record batch written to the snapshot
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "10000"))
+
+# Repeated values stored once per batch; 32-bit indices, since free-text
+# answers (e.g. dietary_restrictions) can take any number of distinct values
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+# Only the fields the reports need: no names, emails or phone numbers leave the database
+SNAPSHOT_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("account_number", pa.string()),
+    ("customer_profile_number", pa.string()),
+    ("customer_type", CATEGORY),
+    ("date_of_birth", pa.date32()),
+    ("birthday_md", pa.int16()),
+    ("profile_completed", pa.bool_()),
+    ("created_at", pa.timestamp("ms")),
+    ("updated_at", pa.timestamp("ms")),
+    ("celebration_budget", CATEGORY),
+    ("group_size_solo", CATEGORY),
+    ("preferred_contact_method", CATEGORY),
+    ("dietary_restrictions", CATEGORY),
+    ("preferred_celebration_style", CATEGORY),
+    ("interest_in_group_private_package", CATEGORY),
+    ("music_ambiance_preference", CATEGORY),
+    ("want_corporate_offers", pa.bool_()),
+    ("interest_in_rewards", pa.bool_()),
+    ("i_like_surprises", pa.bool_()),
+])
+SNAPSHOT_PROJECTION = {"_id": 0, **{field.name: 1 for field in SNAPSHOT_SCHEMA}}
+
+REPORTS = ["signups", "funnel", "birthdays", "budget"]
+
+app = typer.Typer(help="Offline snapshots and reports of Birthday Club customers")
+
+
+def as_date(value) -> Optional[date]:
+    """Dates are stored as ISO strings or as BSON dates"""
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(value)
+
+
+def record_batches(collection, batch_size: int) -> Iterator[pa.RecordBatch]:
+    """Stream the collection as Arrow record batches of `batch_size` documents"""
+    columns = {field.name: [] for field in SNAPSHOT_SCHEMA}
+    cursor = collection.find({}, SNAPSHOT_PROJECTION, batch_size=batch_size)
+    for customer in cursor:
+        for name, values in columns.items():
+            values.append(customer.get(name))
+        if len(columns["id"]) >= batch_size:
+            yield to_record_batch(columns)
+            columns = {field.name: [] for field in SNAPSHOT_SCHEMA}
+    if columns["id"]:
+        yield to_record_batch(columns)
+
+
+def to_record_batch(columns: dict) -> pa.RecordBatch:
+    """Convert one batch of column values to the snapshot schema"""
+    columns["date_of_birth"] = [as_date(value) for value in columns["date_of_birth"]]
+    arrays = []
+    for field in SNAPSHOT_SCHEMA:
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(columns[field.name], pa.string()).dictionary_encode().cast(field.type))
+        else:
+            arrays.append(pa.array(columns[field.name], field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=SNAPSHOT_SCHEMA)
+
+
+def write_snapshot(collection, path: Path, batch_size: int) -> int:
+    """Write the snapshot to `path` (.parquet, or .arrow for an Arrow IPC stream) and return the row count"""
+    rows = 0
+    tmp_path = path.with_name(path.name + ".tmp")
+    if path.suffix == ".arrow":
+        # The stream format lets every batch carry its own dictionaries
+        writer = pa.ipc.new_stream(str(tmp_path), SNAPSHOT_SCHEMA)
+    else:
+        writer = pq.ParquetWriter(str(tmp_path), SNAPSHOT_SCHEMA, compression="zstd")
+    try:
+        for batch in record_batches(collection, batch_size):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        writer.close()
+    # Readers never see a half-written snapshot
+    tmp_path.replace(path)
+    return rows
+
+
+def read_snapshot(path: Path, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Load (some columns of) a snapshot as a DataFrame"""
+    if path.suffix == ".arrow":
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_stream(source).read_all()
+        if columns:
+            table = table.select(columns)
+    else:
+        table = pq.read_table(str(path), columns=columns)
+    return table.to_pandas()
+
+
+def signups_per_day(df: pd.DataFrame) -> pd.DataFrame:
+    """Signups per day, one column per customer type"""
+    days = df["created_at"].dt.floor("D").rename("day")
+    return df.groupby([days, "customer_type"], observed=True).size().unstack(fill_value=0)
+
+
+def completion_funnel(df: pd.DataFrame) -> pd.DataFrame:
+    """Signed up -> profile completed -> opted into rewards, per customer type"""
+    funnel = df.assign(
+        signed_up=1,
+        completed=df["profile_completed"].fillna(False),
+        rewards=df["profile_completed"].fillna(False) & df["interest_in_rewards"].fillna(False),
+    ).groupby("customer_type", observed=True)[["signed_up", "completed", "rewards"]].sum()
+    funnel.loc["all"] = funnel.sum()
+    funnel["completion_rate"] = funnel["completed"] / funnel["signed_up"]
+    funnel["rewards_rate"] = funnel["rewards"] / funnel["completed"].where(funnel["completed"] > 0)
+    return funnel
+
+
+def birthdays_by_month(df: pd.DataFrame) -> pd.DataFrame:
+    """Customers per birth month, by customer type"""
+    # The profile birthday (birthday_md) supersedes the signup date of birth
+    month = (df["birthday_md"] // 100).fillna(pd.to_datetime(df["date_of_birth"]).dt.month)
+    table = pd.crosstab(month.rename("month").astype("Int64"), df["customer_type"])
+    table = table.reindex(range(1, 13), fill_value=0)
+    table.index = [pd.Timestamp(2000, m, 1).strftime("%b") for m in table.index]
+    return table
+
+
+def budget_breakdown(df: pd.DataFrame) -> pd.DataFrame:
+    """Completed profiles by celebration budget and group size"""
+    completed = df[df["profile_completed"].fillna(False)]
+    return pd.crosstab(
+        completed["celebration_budget"], completed["group_size_solo"], margins=True, dropna=False
+    )
+
+
+REPORT_BUILDERS = {
+    "signups": (signups_per_day, ["created_at", "customer_type"]),
+    "funnel": (completion_funnel, ["customer_type", "profile_completed", "interest_in_rewards"]),
+    "birthdays": (birthdays_by_month, ["birthday_md", "date_of_birth", "customer_type"]),
+    "budget": (budget_breakdown, ["profile_completed", "celebration_budget", "group_size_solo"]),
+}
+
+
+@app.command()
+def snapshot(
+    output: Path = typer.Argument(Path("customers.parquet"), help=".parquet, or .arrow for an Arrow IPC stream"),
+    mongo_url: str = typer.Option(MONGO_URL, help="MongoDB to read from"),
+    database: str = typer.Option("birthday_club", help="database name"),
+    batch_size: int = typer.Option(SNAPSHOT_BATCH_SIZE, help="documents per record batch"),
+    read_preference: str = typer.Option(REPORTS_READ_PREFERENCE, help="e.g. secondaryPreferred"),
+):
+    """Stream the customers collection into a columnar snapshot"""
+    client = MongoClient(mongo_url, readPreference=read_preference)
+    try:
+        started = datetime.utcnow()
+        rows = write_snapshot(client[database].customers, output, batch_size)
+        elapsed = (datetime.utcnow() - started).total_seconds()
+    finally:
+        client.close()
+    typer.echo(f"✅ {rows} customers written to {output} in {elapsed:.1f}s")
+
+
+@app.command()
+def report(
+    snapshot_path: Path = typer.Argument(Path("customers.parquet"), help="snapshot written by `snapshot`"),
+    only: Optional[List[str]] = typer.Option(None, "--report", help=f"one of {', '.join(REPORTS)} (repeatable)"),
+    output_dir: Optional[Path] = typer.Option(None, help="also write each report as CSV here"),
+):
+    """Compute reports from a snapshot"""
+    names = only or REPORTS
+    unknown = [name for name in names if name not in REPORT_BUILDERS]
+    if unknown:
+        raise typer.BadParameter(f"unknown report(s): {', '.join(unknown)}; choose from {', '.join(REPORTS)}")
+    if output_dir:
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+    columns = sorted({column for name in names for column in REPORT_BUILDERS[name][1]})
+    df = read_snapshot(snapshot_path, columns)
+    typer.echo(f"📊 {len(df)} customers in {snapshot_path}")
+
+    for name in names:
+        build, _ = REPORT_BUILDERS[name]
+        table = build(df)
+        typer.echo(f"\n{build.__doc__}")
+        typer.echo(table.to_string())
+        if output_dir:
+            table.to_csv(output_dir / f"{name}.csv")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Birthday Club production entry point
+Imports the app once, binds the listening socket and forks uvicorn workers
+that share it. Worker 0 alone runs the campaign scheduler, backfills and
+migrations; SIGTERM or SIGINT drains every worker, flushing buffered
+signups, before exiting. Startup time and memory are logged per worker
+"""
+
+import time
+
+BOOT = time.monotonic()
+
+import argparse  # noqa: E402
+import gc  # noqa: E402
+import logging  # noqa: E402
+import multiprocessing  # noqa: E402
+import os  # noqa: E402
+import signal  # noqa: E402
+import socket  # noqa: E402
+import sys  # noqa: E402
+from multiprocessing.connection import Connection, wait  # noqa: E402
+from typing import Dict, List, Optional  # noqa: E402
+
+import uvicorn  # noqa: E402
+
+import server  # noqa: E402
+
+IMPORT_SECONDS = time.monotonic() - BOOT
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8001"))
+# Worker processes; one per core by default
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+
+logger = logging.getLogger("birthday_club.serve")
+
+
+def proportional_memory_bytes() -> Optional[int]:
+    """Proportional set size: shared pages count once per process sharing them (Linux only)"""
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def mib(size: Optional[int]) -> str:
+    return "n/a" if size is None else f"{size / 1024 / 1024:.1f} MiB"
+
+
+def per_process_warnings(workers: int) -> List[str]:
+    """Settings whose state lives in each worker and so diverges between workers"""
+    if workers == 1:
+        return []
+    warnings = []
+    if server.RATE_LIMIT_BACKEND == "memory":
+        warnings.append(
+            f"RATE_LIMIT_BACKEND=memory: every worker keeps its own buckets, so a client may get up to {workers}x "
+            "the configured rate; use RATE_LIMIT_BACKEND=redis"
+        )
+    if server.EVENT_SOURCE == "memory":
+        warnings.append(
+            "EVENT_SOURCE=memory: /api/events only streams writes made by the worker a client is connected to; "
+            "use a replica set with EVENT_SOURCE=auto or change_stream"
+        )
+    if server.SIGNUP_WRITE_BEHIND:
+        warnings.append(
+            "SIGNUP_WRITE_BEHIND: a profile submitted to another worker than the signup may not find the customer "
+            f"for up to SIGNUP_FLUSH_INTERVAL_SECONDS ({server.SIGNUP_FLUSH_INTERVAL_SECONDS:g}s)"
+        )
+    warnings.append(
+        "Segment counts are kept per worker and only follow that worker's writes between refreshes "
+        f"(SEGMENT_COUNT_TTL_SECONDS={server.SEGMENT_COUNT_TTL_SECONDS:g})"
+    )
+    if server.SEQUENCE_BLOCK_SIZE > 1 or server.SIGNUP_WRITE_BEHIND:
+        warnings.append(
+            "Every worker reserves its own blocks of account numbers: they stay unique but are not issued in "
+            "signup order"
+        )
+    warnings.append(
+        f"Every worker opens up to MONGO_MAX_POOL_SIZE={server.MONGO_MAX_POOL_SIZE} connections "
+        f"({workers * server.MONGO_MAX_POOL_SIZE} in all) and admits MAX_CONCURRENT_WRITES="
+        f"{server.MAX_CONCURRENT_WRITES} writes"
+    )
+    return warnings
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    """The listening socket every worker accepts connections from"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class WorkerServer(uvicorn.Server):
+    """uvicorn server that reports to the master once the app has started"""
+
+    def __init__(self, config: uvicorn.Config, index: int, report, forked_at: float):
+        super().__init__(config)
+        self.index = index
+        self.report = report
+        self.forked_at = forked_at
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets)
+        if not self.started:
+            return
+        self.report.send({
+            "index": self.index,
+            "pid": os.getpid(),
+            "startup_seconds": time.monotonic() - self.forked_at,
+            "rss": server.resident_memory_bytes(),
+            "pss": proportional_memory_bytes(),
+            "event_source": server.event_feed.source,
+        })
+
+    async def shutdown(self, sockets=None):
+        # Open event streams never finish on their own; end them first
+        server.event_feed.close()
+        await super().shutdown(sockets)
+
+
+def run_worker(index: int, workers: int, sock: socket.socket, report, forked_at: float, args):
+    """Body of a worker process: serve the preloaded app on the shared socket"""
+    # uvicorn installs its own handlers once it runs; drop the master's meanwhile
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server.configure_worker(index, workers)
+    config = uvicorn.Config(
+        server.app,
+        backlog=args.backlog,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=server.TRUST_FORWARDED_FOR,
+        access_log=args.access_log,
+    )
+    WorkerServer(config, index, report, forked_at).run(sockets=[sock])
+
+
+class Master:
+    """Forks the workers, restarts those that crash and stops them all on a signal"""
+
+    def __init__(self, args):
+        self.args = args
+        self.context = multiprocessing.get_context("fork")
+        self.sock = bind_socket(args.host, args.port, args.backlog)
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.reports: Dict[Connection, int] = {}  # receiving end of a worker's pipe -> its index
+        self.ready: Dict[int, dict] = {}
+        self.started = False
+        self.stopping = False
+
+    def spawn(self, index: int):
+        receiver, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(
+            target=run_worker,
+            args=(index, self.args.workers, self.sock, sender, time.monotonic(), self.args),
+            name=f"birthday-club-worker-{index}",
+        )
+        process.start()
+        sender.close()
+        self.processes[index] = process
+        self.reports[receiver] = index
+        self.ready.pop(index, None)
+
+    def on_signal(self, signum, frame):
+        if not self.stopping:
+            logger.info("Received %s, stopping %d workers", signal.Signals(signum).name, len(self.processes))
+        self.stop()
+
+    def stop(self):
+        """Ask every worker to finish its requests and exit"""
+        self.stopping = True
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    def on_report(self, receiver: Connection):
+        index = self.reports[receiver]
+        try:
+            report = receiver.recv()
+        except EOFError:
+            # The worker exited
+            del self.reports[receiver]
+            receiver.close()
+            return
+        self.ready[index] = report
+        logger.info(
+            "Worker %d (pid %d) ready in %.2fs: RSS %s, PSS %s",
+            index, report["pid"], report["startup_seconds"], mib(report["rss"]), mib(report["pss"]),
+        )
+        if index == 0 and self.args.workers > 1 and report["event_source"] == "memory":
+            logger.warning("Event feed resolved to the in-process broker: /api/events only streams the writes "
+                           "of the worker a client is connected to")
+        if not self.started and len(self.ready) == self.args.workers:
+            self.started = True
+            pss = [worker["pss"] for worker in self.ready.values()]
+            logger.info(
+                "%d workers serving on %s:%d, %.2fs after launch (app import %.2fs): RSS %s in all, PSS %s in all",
+                self.args.workers, self.args.host, self.args.port, time.monotonic() - BOOT, IMPORT_SECONDS,
+                mib(sum(worker["rss"] for worker in self.ready.values())),
+                mib(sum(pss) if None not in pss else None),
+            )
+
+    def on_exit(self, index: int) -> bool:
+        """Handle a worker that exited; False when the whole server must stop"""
+        process = self.processes.pop(index)
+        process.join()
+        if self.stopping:
+            return True
+        if index not in self.ready:
+            # It never started (bad configuration, MongoDB unreachable): a
+            # restart would fail the same way
+            logger.error("Worker %d exited with code %s before it was ready", index, process.exitcode)
+            return False
+        logger.warning("Worker %d (pid %d) exited with code %s; restarting it", index, process.pid, process.exitcode)
+        self.spawn(index)
+        return True
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.on_signal)
+        signal.signal(signal.SIGINT, self.on_signal)
+        for warning in per_process_warnings(self.args.workers):
+            logger.warning(warning)
+        logger.info("Preloaded the app in %.2fs (master RSS %s); starting %d workers",
+                    IMPORT_SECONDS, mib(server.resident_memory_bytes()), self.args.workers)
+
+        # Keep objects created at import out of the collector's reach so its
+        # bookkeeping does not copy the pages the workers share
+        gc.freeze()
+        for index in range(self.args.workers):
+            self.spawn(index)
+
+        exit_code = 0
+        deadline: Optional[float] = None
+        while self.processes:
+            if self.stopping and deadline is None:
+                deadline = time.monotonic() + self.args.graceful_timeout + 10
+            if deadline is not None and time.monotonic() > deadline:
+                for index, process in self.processes.items():
+                    logger.error("Worker %d did not stop in time; killing it", index)
+                    process.kill()
+                deadline = float("inf")
+
+            sentinels = {process.sentinel: index for index, process in self.processes.items()}
+            for ready in wait(list(sentinels) + list(self.reports), timeout=1):
+                if isinstance(ready, Connection):
+                    self.on_report(ready)
+                elif not self.on_exit(sentinels[ready]) and not self.stopping:
+                    exit_code = 1
+                    self.stop()
+
+        self.sock.close()
+        logger.info("All workers stopped")
+        return exit_code
+
+
+def main():
+    """Run the API with several worker processes"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default=HOST, help="address to listen on")
+    parser.add_argument("--port", type=int, default=PORT, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY, help="worker processes")
+    parser.add_argument("--backlog", type=int, default=2048, help="pending connections the socket queues")
+    parser.add_argument("--graceful-timeout", type=int, default=server.GRACEFUL_TIMEOUT_SECONDS,
+                        help="seconds a stopping worker may spend finishing requests")
+    parser.add_argument("--no-access-log", dest="access_log", action="store_false", help="skip per-request logs")
+    args = parser.parse_args()
+    args.workers = max(1, args.workers)
+    return Master(args).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,33 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
-from datetime import datetime, date
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, EmailStr, ValidationError
+from typing import Optional, List, Dict, Any, Union
+from datetime import datetime, date, timedelta
+import calendar
+import math
+import asyncio
+import hashlib
+import base64
+import csv
+import difflib
+import glob
+import io
 import json
+import logging
+import orjson
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from contextlib import aclosing, asynccontextmanager
+from contextvars import ContextVar
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
 import os
 import uuid
 from dotenv import load_dotenv
@@ -12,21 +35,417 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="Birthday Club API", description="Customer Management System for Birthday Club")
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger("birthday_club")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the MongoDB client, run startup work, and release both on shutdown"""
+    global client, db
+    client = create_mongo_client()
+    db = client.birthday_club
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+        client.close()
+
+app = FastAPI(title="Birthday Club API", description="Customer Management System for Birthday Club", lifespan=lifespan)
 
 # CORS middleware
+# Comma-separated origins allowed to call the API, e.g. "https://club.example.com"
+CORS_ALLOW_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ALLOW_ORIGINS", "*").split(",") if origin.strip()]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=CORS_ALLOW_ORIGINS,
+    # Browsers refuse credentials with a wildcard origin
+    allow_credentials=CORS_ALLOW_ORIGINS != ["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    # Response headers scripts on another origin may read: the list's keyset cursor and request timings
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
+# Request instrumentation
+# Requests slower than this are logged together with their MongoDB commands
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0.5"))
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+class LatencyHistogram:
+    """Cumulative latency histogram with fixed buckets, Prometheus style"""
+
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+class RouteMetrics:
+    """Latency and database usage of one route"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.statuses: Dict[int, int] = {}
+        self.db_commands = 0
+        self.db_seconds = 0.0
+
+class RequestTrace:
+    """MongoDB commands issued while serving one request"""
+
+    def __init__(self):
+        self.commands: List[tuple] = []  # (command, collection, seconds, ok)
+        self._collections: Dict[int, str] = {}
+
+    @property
+    def db_seconds(self) -> float:
+        return sum(seconds for _, _, seconds, _ in self.commands)
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+route_metrics: Dict[tuple, RouteMetrics] = {}
+command_metrics: Dict[str, list] = {}  # command -> [count, seconds, failures]
+# Commands complete on PyMongo's threads: updates of command_metrics hold this lock
+command_metrics_lock = threading.Lock()
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Attribute every MongoDB command to the request that issued it
+
+    Motor runs PyMongo calls with a copy of the caller's context, so the
+    request's trace is visible here even though this runs on a worker thread.
+    """
+
+    def started(self, event):
+        trace = current_trace.get()
+        if trace is not None:
+            collection = event.command.get(event.command_name)
+            trace._collections[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        self._record(event, True)
+
+    def failed(self, event):
+        self._record(event, False)
+
+    def _record(self, event, ok: bool):
+        seconds = event.duration_micros / 1_000_000
+        with command_metrics_lock:
+            totals = command_metrics.setdefault(event.command_name, [0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += 0 if ok else 1
+        trace = current_trace.get()
+        if trace is not None:
+            collection = trace._collections.pop(event.request_id, "")
+            trace.commands.append((event.command_name, collection, seconds, ok))
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """Record per-route latency and DB round trips, and report them in Server-Timing"""
+    trace = RequestTrace()
+    token = current_trace.set(trace)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        current_trace.reset(token)
+    elapsed = time.perf_counter() - started
+    
+    route = request.scope.get("route")
+    key = (request.method, route.path if route else "unmatched")
+    metrics = route_metrics.setdefault(key, RouteMetrics())
+    metrics.latency.observe(elapsed)
+    metrics.statuses[response.status_code] = metrics.statuses.get(response.status_code, 0) + 1
+    metrics.db_commands += len(trace.commands)
+    metrics.db_seconds += trace.db_seconds
+    
+    response.headers["Server-Timing"] = (
+        f'app;dur={elapsed * 1000:.1f}, db;dur={trace.db_seconds * 1000:.1f};desc="{len(trace.commands)} commands"'
+    )
+    if elapsed > SLOW_REQUEST_SECONDS:
+        logger.warning(
+            "Slow request %s %s took %.0f ms, %d MongoDB commands: %s",
+            request.method,
+            request.url.path,
+            elapsed * 1000,
+            len(trace.commands),
+            ", ".join(f"{command}({collection}) {seconds * 1000:.1f} ms" for command, collection, seconds, _ in trace.commands),
+        )
+    return response
+
+def resident_memory_bytes() -> int:
+    """Resident set size of this process (its peak where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def render_metrics() -> str:
+    """Render all request and MongoDB metrics in the Prometheus text format"""
+    lines = [
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, route), metrics in sorted(route_metrics.items()):
+        labels = f'method="{method}",route="{route}"'
+        cumulative = 0
+        for bound, count in zip([*metrics.latency.buckets, "+Inf"], metrics.latency.counts):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"http_request_duration_seconds_sum{{{labels}}} {metrics.latency.sum}")
+        lines.append(f"http_request_duration_seconds_count{{{labels}}} {metrics.latency.count}")
+    
+    lines.append("# TYPE http_request_duration_quantile_seconds gauge")
+    for (method, route), metrics in sorted(route_metrics.items()):
+        for q in (0.5, 0.95, 0.99):
+            lines.append(
+                f'http_request_duration_quantile_seconds{{method="{method}",route="{route}",quantile="{q}"}} '
+                f"{metrics.latency.quantile(q)}"
+            )
+    
+    lines.append("# TYPE http_responses_total counter")
+    for (method, route), metrics in sorted(route_metrics.items()):
+        for status, count in sorted(metrics.statuses.items()):
+            lines.append(f'http_responses_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+    
+    lines.append("# TYPE http_request_db_commands_total counter")
+    lines.append("# TYPE http_request_db_seconds_total counter")
+    for (method, route), metrics in sorted(route_metrics.items()):
+        labels = f'method="{method}",route="{route}"'
+        lines.append(f"http_request_db_commands_total{{{labels}}} {metrics.db_commands}")
+        lines.append(f"http_request_db_seconds_total{{{labels}}} {metrics.db_seconds}")
+    
+    lines.append("# TYPE mongodb_commands_total counter")
+    lines.append("# TYPE mongodb_command_seconds_total counter")
+    lines.append("# TYPE mongodb_command_failures_total counter")
+    with command_metrics_lock:
+        commands = sorted((command, list(totals)) for command, totals in command_metrics.items())
+    for command, (count, seconds, failures) in commands:
+        lines.append(f'mongodb_commands_total{{command="{command}"}} {count}')
+        lines.append(f'mongodb_command_seconds_total{{command="{command}"}} {seconds}')
+        lines.append(f'mongodb_command_failures_total{{command="{command}"}} {failures}')
+    
+    lines.append("# TYPE signup_buffer_depth gauge")
+    lines.append(f"signup_buffer_depth {len(signup_buffer.pending)}")
+    lines.append("# TYPE signup_buffer_flush_seconds histogram")
+    cumulative = 0
+    for bound, count in zip([*signup_buffer.flush_latency.buckets, "+Inf"], signup_buffer.flush_latency.counts):
+        cumulative += count
+        lines.append(f'signup_buffer_flush_seconds_bucket{{le="{bound}"}} {cumulative}')
+    lines.append(f"signup_buffer_flush_seconds_sum {signup_buffer.flush_latency.sum}")
+    lines.append(f"signup_buffer_flush_seconds_count {signup_buffer.flush_latency.count}")
+    lines.append("# TYPE signup_buffer_documents_total counter")
+    for result, count in sorted(signup_buffer.documents.items()):
+        lines.append(f'signup_buffer_documents_total{{result="{result}"}} {count}')
+    lines.append("# TYPE signup_buffer_flush_errors_total counter")
+    lines.append(f"signup_buffer_flush_errors_total {signup_buffer.flush_errors}")
+    
+    lines.append("# TYPE rate_limited_requests_total counter")
+    lines.append(f"rate_limited_requests_total {rate_limiter.limited}")
+    lines.append("# TYPE write_requests_in_flight gauge")
+    lines.append(f"write_requests_in_flight {write_admission.in_flight}")
+    lines.append("# TYPE write_requests_shed_total counter")
+    lines.append(f"write_requests_shed_total {write_admission.shed}")
+    
+    lines.append("# TYPE process_resident_memory_bytes gauge")
+    lines.append(f'process_resident_memory_bytes{{worker="{WORKER_INDEX}"}} {resident_memory_bytes()}')
+    return "\n".join(lines) + "\n"
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Track open and checked-out connections to report pool utilization"""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.check_out_failures = 0
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        self.check_out_failures += 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
 # Database connection
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-client = AsyncIOMotorClient(MONGO_URL)
-db = client.birthday_club
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))  # 0 = no timeout
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0"))  # 0 = wait forever
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")  # e.g. "zstd,snappy,zlib"
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+# Read preference of the list/export/stats reads, e.g. "secondaryPreferred" on a replica set
+MONGO_LIST_READ_PREFERENCE = os.getenv("MONGO_LIST_READ_PREFERENCE", "primary")
+
+pool_listener = PoolListener()
+
+def create_mongo_client() -> AsyncIOMotorClient:
+    """MongoDB client configured from the MONGO_* environment variables"""
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "readPreference": MONGO_READ_PREFERENCE,
+        "event_listeners": [MongoCommandListener(), pool_listener],
+    }
+    if MONGO_SOCKET_TIMEOUT_MS:
+        options["socketTimeoutMS"] = MONGO_SOCKET_TIMEOUT_MS
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = MONGO_WAIT_QUEUE_TIMEOUT_MS
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return AsyncIOMotorClient(MONGO_URL, **options)
+
+# Created by the app lifespan (one client per process)
+client: Optional[AsyncIOMotorClient] = None
+db = None
+
+def read_customers():
+    """Customers collection for list/export/stats reads, which may go to secondaries"""
+    return db.get_collection(
+        "customers",
+        read_preference=make_read_preference(read_pref_mode_from_name(MONGO_LIST_READ_PREFERENCE), None),
+    )
+
+# Numbers handed out per counter round trip; values > 1 keep a per-process block
+SEQUENCE_BLOCK_SIZE = int(os.getenv("SEQUENCE_BLOCK_SIZE", "1"))
+
+# Enforce one account per email address / phone number with unique indexes
+ENFORCE_UNIQUE_CONTACT = os.getenv("ENFORCE_UNIQUE_CONTACT", "true").lower() == "true"
+
+# Largest page GET /api/customers will return, and documents per export batch
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Most rows accepted by one bulk signup/profile request
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "50000"))
+
+# Customer lookup cache: "memory" (per process), "redis" (shared) or "none"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Documents rewritten per batch by background backfills
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "1000"))
+
+# Birthday campaign scheduler
+CAMPAIGN_SCHEDULER_ENABLED = os.getenv("CAMPAIGN_SCHEDULER_ENABLED", "false").lower() == "true"
+CAMPAIGN_INTERVAL_SECONDS = float(os.getenv("CAMPAIGN_INTERVAL_SECONDS", "3600"))
+CAMPAIGN_LEAD_DAYS = int(os.getenv("CAMPAIGN_LEAD_DAYS", "7"))
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", "500"))
+CAMPAIGN_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY", "10"))
+CAMPAIGN_RATE_PER_SECOND = float(os.getenv("CAMPAIGN_RATE_PER_SECOND", "20"))
+# Channel of customers whose preferred contact method has no sender
+CAMPAIGN_FALLBACK_CHANNEL = os.getenv("CAMPAIGN_FALLBACK_CHANNEL", "email")
+# Failed deliveries, and those left pending this long (a crashed run), are retried
+# by later runs, up to CAMPAIGN_MAX_ATTEMPTS sends per customer and birthday
+CAMPAIGN_CLAIM_TIMEOUT_SECONDS = float(os.getenv("CAMPAIGN_CLAIM_TIMEOUT_SECONDS", "900"))
+CAMPAIGN_MAX_ATTEMPTS = int(os.getenv("CAMPAIGN_MAX_ATTEMPTS", "3"))
+
+# Segment counts: how many are kept up to date, and how long a count is trusted
+SEGMENT_MAX_TRACKED = int(os.getenv("SEGMENT_MAX_TRACKED", "200"))
+SEGMENT_COUNT_TTL_SECONDS = float(os.getenv("SEGMENT_COUNT_TTL_SECONDS", "900"))
+SEGMENT_TRACKED_REFRESH_SECONDS = float(os.getenv("SEGMENT_TRACKED_REFRESH_SECONDS", "30"))
+
+# Customer search: most results returned, documents ranked per query, and its time budget
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "20"))
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "200"))
+SEARCH_MAX_TIME_MS = int(os.getenv("SEARCH_MAX_TIME_MS", "500"))
+
+# Event feed: "change_stream", "memory" (in-process pub/sub) or "auto" (change streams on a replica set)
+EVENT_SOURCE = os.getenv("EVENT_SOURCE", "auto")
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))
+EVENT_KEEPALIVE_SECONDS = float(os.getenv("EVENT_KEEPALIVE_SECONDS", "15"))
+EVENT_MAX_CLIENTS = int(os.getenv("EVENT_MAX_CLIENTS", "100"))
+# Longest one stream stays open: browsers reconnect with Last-Event-ID, and an
+# open dashboard never holds a stopping server (which waits for every connection)
+EVENT_STREAM_MAX_SECONDS = float(os.getenv("EVENT_STREAM_MAX_SECONDS", "60"))
+
+# Write-behind signups: acknowledge at once and insert in batches of up to
+# SIGNUP_FLUSH_SIZE or every SIGNUP_FLUSH_INTERVAL_SECONDS
+SIGNUP_WRITE_BEHIND = os.getenv("SIGNUP_WRITE_BEHIND", "false").lower() == "true"
+SIGNUP_FLUSH_SIZE = int(os.getenv("SIGNUP_FLUSH_SIZE", "500"))
+SIGNUP_FLUSH_INTERVAL_SECONDS = float(os.getenv("SIGNUP_FLUSH_INTERVAL_SECONDS", "0.05"))
+# Most signups waiting to be written; further signups wait up to the timeout, then get a 503
+SIGNUP_BUFFER_MAX_DOCS = int(os.getenv("SIGNUP_BUFFER_MAX_DOCS", "10000"))
+SIGNUP_BACKPRESSURE_TIMEOUT_SECONDS = float(os.getenv("SIGNUP_BACKPRESSURE_TIMEOUT_SECONDS", "2"))
+# Account numbers reserved per round trip for buffered signups
+SIGNUP_SEQUENCE_BLOCK_SIZE = int(os.getenv("SIGNUP_SEQUENCE_BLOCK_SIZE", "100"))
+# Append-only journal of buffered signups, replayed on startup ("" disables it)
+SIGNUP_JOURNAL_PATH = os.getenv("SIGNUP_JOURNAL_PATH", "")
+SIGNUP_JOURNAL_FSYNC = os.getenv("SIGNUP_JOURNAL_FSYNC", "true").lower() == "true"
+SIGNUP_JOURNAL_COMPACT_BYTES = int(os.getenv("SIGNUP_JOURNAL_COMPACT_BYTES", str(64 * 1024 * 1024)))
+
+# Per-client rate limit of the write endpoints: "memory" (per process), "redis" (shared) or "none"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "5"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "20"))
+# Tokens one bulk request costs, and most clients the memory backend remembers
+RATE_LIMIT_BULK_COST = float(os.getenv("RATE_LIMIT_BULK_COST", "10"))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000"))
+# Comma-separated API keys (X-API-Key) limited per key rather than per IP
+RATE_LIMIT_API_KEYS = {key.strip() for key in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if key.strip()}
+# Take the client IP from X-Forwarded-For (only behind a trusted proxy)
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+# Write requests handled at once per process; more are shed with a 429 before the pool runs dry
+MAX_CONCURRENT_WRITES = int(os.getenv("MAX_CONCURRENT_WRITES", str(max(1, int(MONGO_MAX_POOL_SIZE * 0.8)))))
+
+# This process's place among the workers of serve.py (which sets both after
+# forking); only worker 0 runs the campaign scheduler, backfills and migrations
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+# How long a stopping server lets requests finish before cancelling them
+GRACEFUL_TIMEOUT_SECONDS = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", "20"))
+
+# Serve /api/stats from the incrementally maintained stats document
+STATS_MATERIALIZED = os.getenv("STATS_MATERIALIZED", "true").lower() == "true"
 
 # Pydantic models
 class CustomerSignup(BaseModel):
@@ -72,47 +491,2172 @@ class CustomerResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class SegmentFilter(BaseModel):
+    """Marketing segment over completed profiles; a list matches any of its values"""
+    customer_type: Optional[Union[str, List[str]]] = None
+    celebration_budget: Optional[Union[str, List[str]]] = None
+    group_size_solo: Optional[Union[str, List[str]]] = None
+    dietary_restrictions: Optional[Union[str, List[str]]] = None
+    preferred_contact_method: Optional[Union[str, List[str]]] = None
+    interest_in_group_private_package: Optional[Union[str, List[str]]] = None
+    music_ambiance_preference: Optional[Union[str, List[str]]] = None
+    preferred_celebration_style: Optional[Union[str, List[str]]] = None
+    want_corporate_offers: Optional[bool] = None
+    interest_in_rewards: Optional[bool] = None
+    i_like_surprises: Optional[bool] = None
+
+class SegmentQuery(BaseModel):
+    filter: SegmentFilter
+    limit: int = 50
+    cursor: Optional[str] = None
+
 # Helper functions
+ACCOUNT_NUMBER_PREFIXES = {
+    "subscription": "SAN",
+    "non_subscription": "NSAN",
+    "corporate": "CSAN",
+}
+DEFAULT_ACCOUNT_NUMBER_PREFIX = "GEN"
+
+PROFILE_NUMBER_PREFIXES = {
+    "subscription": "SCPN",
+    "non_subscription": "NSCPN",
+    "corporate": "CSCPN",
+}
+DEFAULT_PROFILE_NUMBER_PREFIX = "GCPN"
+
+def account_number_prefix(customer_type: str) -> str:
+    """Account number prefix for a customer type"""
+    return ACCOUNT_NUMBER_PREFIXES.get(customer_type, DEFAULT_ACCOUNT_NUMBER_PREFIX)
+
+def profile_number_prefix(customer_type: str) -> str:
+    """Customer profile number prefix for a customer type"""
+    return PROFILE_NUMBER_PREFIXES.get(customer_type, DEFAULT_PROFILE_NUMBER_PREFIX)
+
 def generate_account_number(customer_type: str, count: int) -> str:
     """Generate account number based on customer type"""
-    if customer_type == "subscription":
-        return f"SAN-{count:05d}"
-    elif customer_type == "non_subscription":
-        return f"NSAN-{count:05d}"
-    elif customer_type == "corporate":
-        return f"CSAN-{count:05d}"
-    else:
-        return f"GEN-{count:05d}"
+    return f"{account_number_prefix(customer_type)}-{count:05d}"
 
 def generate_profile_number(customer_type: str, count: int) -> str:
     """Generate customer profile number based on customer type"""
-    if customer_type == "subscription":
-        return f"SCPN-{count:05d}"
-    elif customer_type == "non_subscription":
-        return f"NSCPN-{count:05d}"
-    elif customer_type == "corporate":
-        return f"CSCPN-{count:05d}"
-    else:
-        return f"GCPN-{count:05d}"
+    return f"{profile_number_prefix(customer_type)}-{count:05d}"
+
+class SequenceAllocator:
+    """Allocate monotonically increasing numbers from the counters collection.
+
+    Every counter is a document ``{"_id": name, "seq": last_value}`` bumped with
+    an atomic ``$inc``, so concurrent callers (and processes) never receive the
+    same value. With ``block_size > 1`` a whole block is reserved per round trip
+    and handed out from memory; numbers left in a block when the process exits
+    are skipped, never reused.
+    """
+
+    def __init__(self, block_size: int = 1):
+        self.block_size = max(1, block_size)
+        self._blocks: Dict[str, List[int]] = {}  # name -> [next_value, last_value]
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def reserve(self, name: str, count: int = 1) -> int:
+        """Atomically reserve `count` consecutive numbers and return the first"""
+        counter = await db.counters.find_one_and_update(
+            {"_id": name},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter["seq"] - count + 1
+
+    async def next(self, name: str) -> int:
+        """Return the next number for a counter"""
+        if self.block_size == 1:
+            return await self.reserve(name)
+
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            block = self._blocks.get(name)
+            if block is None or block[0] > block[1]:
+                start = await self.reserve(name, self.block_size)
+                block = [start, start + self.block_size - 1]
+                self._blocks[name] = block
+            value = block[0]
+            block[0] += 1
+            return value
+
+    async def seed(self, name: str, value: int):
+        """Make sure a counter is at least `value` (never moves it backwards)"""
+        await db.counters.update_one({"_id": name}, {"$max": {"seq": value}}, upsert=True)
+
+sequences = SequenceAllocator(SEQUENCE_BLOCK_SIZE)
+
+def account_counter_name(customer_type: str) -> str:
+    """Counter that backs account numbers for a customer type"""
+    return f"account_number:{account_number_prefix(customer_type)}"
+
+def profile_counter_name(customer_type: str) -> str:
+    """Counter that backs customer profile numbers for a customer type"""
+    return profile_prefix_counter_name(profile_number_prefix(customer_type))
+
+def profile_prefix_counter_name(prefix: str) -> str:
+    """Counter that backs customer profile numbers with a given prefix"""
+    return f"customer_profile_number:{prefix}"
 
 async def get_next_account_number(customer_type: str) -> str:
     """Get the next available account number for customer type"""
-    collection = db.customers
-    
-    # Count existing customers of this type
-    count = await collection.count_documents({"customer_type": customer_type})
-    return generate_account_number(customer_type, count + 1)
+    count = await sequences.next(account_counter_name(customer_type))
+    return generate_account_number(customer_type, count)
 
 async def get_next_profile_number(customer_type: str) -> str:
     """Get the next available profile number for customer type"""
-    collection = db.customers
+    count = await sequences.next(profile_counter_name(customer_type))
+    return generate_profile_number(customer_type, count)
+
+async def highest_issued_number(field: str, prefix: str) -> int:
+    """Largest number issued with a prefix ("SAN-00042" -> 42), 0 if none"""
+    result = await db.customers.aggregate([
+        {"$match": {field: {"$regex": f"^{re.escape(prefix)}-"}}},
+        {"$group": {"_id": None, "highest": {"$max": {"$toInt": {"$arrayElemAt": [{"$split": [f"${field}", "-"]}, 1]}}}}},
+    ]).to_list(1)
+    return (result[0]["highest"] or 0) if result else 0
+
+async def seed_sequences():
+    """Start missing counters after the highest number already issued
+
+    Deleted customers leave gaps, so the count of issued numbers can be
+    lower than numbers still in use. Counters that exist are left alone.
+    """
+    counters = [("account_number", prefix, f"account_number:{prefix}")
+                for prefix in [*ACCOUNT_NUMBER_PREFIXES.values(), DEFAULT_ACCOUNT_NUMBER_PREFIX]]
+    counters += [("customer_profile_number", prefix, profile_prefix_counter_name(prefix))
+                 for prefix in [*PROFILE_NUMBER_PREFIXES.values(), DEFAULT_PROFILE_NUMBER_PREFIX]]
+    for field, prefix, name in counters:
+        if await db.counters.find_one({"_id": name}) is None:
+            await sequences.seed(name, await highest_issued_number(field, prefix))
+
+# Version of the customer document layout written by this code:
+#   1: dates as ISO strings
+#   2: dates as BSON dates (midnight UTC), plus birth_month / birth_day
+SCHEMA_VERSION = 2
+DATE_FIELDS = ("date_of_birth", "birthday_date")
+
+def stored_date(value: date) -> datetime:
+    """BSON has no date-only type: store dates as midnight UTC"""
+    return datetime(value.year, value.month, value.day)
+
+def read_date(value) -> Optional[date]:
+    """A stored date of either schema version as a `date`"""
+    if value is None or type(value) is date:
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(value[:10])
+
+def normalize_customer(customer: dict) -> dict:
+    """Give documents of every schema version the same date types (in place)"""
+    for field in DATE_FIELDS:
+        if field in customer:
+            customer[field] = read_date(customer[field])
+    return customer
+
+def birthday_month_day(value) -> int:
+    """Month-day key (MMDD as an int, e.g. 115 for Jan 15) of a stored or parsed date"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return value.month * 100 + value.day
+
+def build_customer_document(customer: CustomerSignup, account_number: str) -> dict:
+    """Customer document stored for a signup"""
+    now = datetime.utcnow()
+    return {
+        "id": str(uuid.uuid4()),
+        "account_number": account_number,
+        "customer_profile_number": None,
+        "customer_type": customer.customer_type,
+        "name": customer.name,
+        "email": customer.email,
+        "phone_number": customer.phone_number,
+        "date_of_birth": stored_date(customer.date_of_birth),
+        "birth_month": customer.date_of_birth.month,
+        "birth_day": customer.date_of_birth.day,
+        "birthday_md": birthday_month_day(customer.date_of_birth),
+        "search_keys": search_keys(customer.name, customer.email, customer.phone_number),
+        **contact_keys(customer.email, customer.phone_number),
+        "profile_completed": False,
+        "created_at": now,
+        "updated_at": now,
+        "schema_version": SCHEMA_VERSION,
+    }
+
+def profile_field_values(profile: CustomerProfile) -> dict:
+    """Stored values of the submitted profile fields"""
+    # The account number comes from the URL / lookup, never from the payload
+    profile_data = profile.dict(exclude={"account_number"})
+    # The profile's birthday date supersedes the signup date of birth
+    profile_data["birth_month"] = profile.birthday_date.month
+    profile_data["birth_day"] = profile.birthday_date.day
+    profile_data["birthday_md"] = birthday_month_day(profile.birthday_date)
+    profile_data["birthday_date"] = stored_date(profile.birthday_date)
+    return profile_data
+
+def build_profile_fields(profile: CustomerProfile, profile_number: str) -> dict:
+    """Customer fields written when a profile is completed for the first time"""
+    profile_data = profile_field_values(profile)
+    profile_data["profile_search_keys"] = profile_search_keys(profile_data)
+    profile_data.update(contact_keys(None, profile_data["phone_number"]))
+    profile_data["customer_profile_number"] = profile_number
+    profile_data["profile_completed"] = True
+    profile_data["updated_at"] = datetime.utcnow()
+    return profile_data
+
+def profile_resubmission_update(profile_data: dict, now: datetime) -> list:
+    """Update pipeline for an already completed profile
+
+    Fields are set unconditionally (MongoDB skips the write when nothing
+    changes) and `updated_at` only moves when at least one field differs.
+    """
+    unchanged = {"$and": [
+        {"$eq": [{"$ifNull": [f"${field}", None]}, {"$literal": value}]}
+        for field, value in profile_data.items()
+    ]}
+    phone = phone_key(profile_data["phone_number"])
+    return [{
+        "$set": {
+            **{field: {"$literal": value} for field, value in profile_data.items()},
+            "profile_search_keys": {"$literal": profile_search_keys(profile_data)},
+            # Never store a null key: every such customer would collide
+            "phone_key": {"$literal": phone} if phone else "$$REMOVE",
+            "updated_at": {"$cond": [unchanged, "$updated_at", now]},
+        }
+    }]
+
+async def resubmit_profile(account_number: str, profile: CustomerProfile) -> Optional[tuple]:
+    """Apply a profile to an already completed customer in one round trip
+
+    Returns the (before, after) documents, or None when the customer does not
+    exist or has not completed a profile yet.
+    """
+    profile_data = profile_field_values(profile)
+    now = datetime.utcnow()
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)  # BSON dates keep milliseconds
+    before = await db.customers.find_one_and_update(
+        {"account_number": account_number, "profile_completed": True},
+        profile_resubmission_update(profile_data, now),
+        projection=CUSTOMER_DOCUMENT_PROJECTION,
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        return None
+    unchanged = all(before.get(field) == value for field, value in profile_data.items())
+    return before, {**before, **profile_data, "updated_at": before["updated_at"] if unchanged else now}
+
+# Indexes
+def customer_indexes() -> List[IndexModel]:
+    """Indexes backing every query the API runs against the customers collection"""
+    indexes = [
+        # Lookups by account number (get/complete profile) and number uniqueness
+        IndexModel([("account_number", ASCENDING)], unique=True),
+        IndexModel(
+            [("customer_profile_number", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"customer_profile_number": {"$type": "string"}},
+        ),
+        # GET /api/customers filters and keyset pages, newest first
+        IndexModel([
+            ("customer_type", ASCENDING),
+            ("profile_completed", ASCENDING),
+            ("created_at", DESCENDING),
+            ("id", DESCENDING),
+        ]),
+        IndexModel([("profile_completed", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)]),
+        # Upcoming birthdays, with and without a customer_type filter
+        IndexModel([("birthday_md", ASCENDING)]),
+        IndexModel([("customer_type", ASCENDING), ("birthday_md", ASCENDING)]),
+        # Customer search (multikey)
+        IndexModel([("search_keys", ASCENDING)]),
+        IndexModel([("profile_search_keys", ASCENDING)]),
+        # Segment counts over completed profiles
+        IndexModel(
+            [("customer_type", ASCENDING), ("celebration_budget", ASCENDING), ("group_size_solo", ASCENDING)],
+            partialFilterExpression={"profile_completed": True},
+        ),
+        IndexModel([("dietary_restrictions", ASCENDING)], partialFilterExpression={"profile_completed": True}),
+        IndexModel([("preferred_contact_method", ASCENDING)], partialFilterExpression={"profile_completed": True}),
+        IndexModel([("preferred_celebration_style", ASCENDING)], partialFilterExpression={"profile_completed": True}),
+    ]
+    # Signup retries carrying the same Idempotency-Key resolve to one customer
+    indexes.append(IndexModel([("idempotency_key", ASCENDING)], unique=True, sparse=True))
+    if ENFORCE_UNIQUE_CONTACT:
+        # On the normalized keys, so "Jose@Example.com" and "+1 555 123 4567"
+        # collide with "jose@example.com" and "+15551234567"; sparse because
+        # customers whose keys clash from before are left without them
+        indexes.append(IndexModel([("email_key", ASCENDING)], unique=True, sparse=True))
+        indexes.append(IndexModel([("phone_key", ASCENDING)], unique=True, sparse=True))
+    return indexes
+
+# Unique index fields reported under the customer field they are derived from
+DUPLICATE_KEY_FIELDS = {"email_key": "email", "phone_key": "phone_number"}
+
+def duplicate_key_field(details: Optional[dict]) -> str:
+    """Field of the unique index a duplicate key error was raised by"""
+    key_pattern = (details or {}).get("keyPattern") or {}
+    if key_pattern:
+        field = next(iter(key_pattern))
+        return DUPLICATE_KEY_FIELDS.get(field, field)
+    # Older servers only name the index in the message
+    message = (details or {}).get("errmsg", "")
+    for field in ("account_number", "customer_profile_number", "idempotency_key", "email_key", "phone_key"):
+        if f"index: {field}_" in message:
+            return DUPLICATE_KEY_FIELDS.get(field, field)
+    return "key"
+
+index_status: List[dict] = []
+
+async def ensure_indexes():
+    """Create the declared indexes, logging the outcome of each build"""
+    index_status.clear()
+    for index in customer_indexes():
+        keys = dict(index.document["key"])
+        try:
+            name = (await db.customers.create_indexes([index]))[0]
+            index_status.append({"name": name, "keys": keys, "status": "ready"})
+            logger.info("Index %s on customers is ready", name)
+        except OperationFailure as e:
+            index_status.append({"name": index.document["name"], "keys": keys, "status": "failed", "error": str(e)})
+            logger.warning("Could not build index %s on customers: %s", index.document["name"], e)
+
+def route_query_shapes() -> List[dict]:
+    """Representative query for every route, used to check their plans"""
+    return [
+        {"route": "GET /api/customers/{account_number}", "filter": {"account_number": "SAN-00001"}},
+        {"route": "GET /api/customers/{account_number}/profile", "filter": {"account_number": "SAN-00001"}},
+        {"route": "POST /api/customers/{account_number}/profile", "filter": {"account_number": "SAN-00001"}},
+        {"route": "GET /api/customers", "filter": {}, "sort": CUSTOMER_LIST_SORT},
+        {
+            "route": "GET /api/customers?customer_type",
+            "filter": {"customer_type": "subscription"},
+            "sort": CUSTOMER_LIST_SORT,
+        },
+        {
+            "route": "GET /api/customers?profile_completed",
+            "filter": {"profile_completed": True},
+            "sort": CUSTOMER_LIST_SORT,
+        },
+        {
+            "route": "GET /api/customers?customer_type&profile_completed",
+            "filter": {"customer_type": "subscription", "profile_completed": True},
+            "sort": CUSTOMER_LIST_SORT,
+        },
+        {
+            "route": "GET /api/customers?cursor",
+            "filter": keyset_filter({}, (datetime(2024, 1, 1), "00000000-0000-0000-0000-000000000000")),
+            "sort": CUSTOMER_LIST_SORT,
+        },
+        {
+            "route": "GET /api/birthdays/upcoming",
+            "filter": {"birthday_md": {"$gte": 1225, "$lte": 1231}},
+            "sort": BIRTHDAY_SORT,
+        },
+        {
+            "route": "GET /api/birthdays/upcoming?customer_type",
+            "filter": {"customer_type": "corporate", "birthday_md": {"$gte": 101, "$lte": 107}},
+            "sort": BIRTHDAY_SORT,
+        },
+    ]
+
+def plan_stages(plan: dict) -> List[dict]:
+    """Flatten an explain plan tree into its stages, outermost first"""
+    stages = [plan]
+    if "inputStage" in plan:
+        stages.extend(plan_stages(plan["inputStage"]))
+    for child in plan.get("inputStages", []):
+        stages.extend(plan_stages(child))
+    return stages
+
+async def explain_route_query(shape: dict) -> dict:
+    """Explain one route query and summarise how it is executed"""
+    cursor = db.customers.find(shape["filter"]).limit(50)
+    if shape.get("sort"):
+        cursor = cursor.sort(shape["sort"])
+    explain = await cursor.explain()
+    winning_plan = explain["queryPlanner"]["winningPlan"]
+    stages = plan_stages(winning_plan.get("queryPlan", winning_plan))
+    return {
+        "route": shape["route"],
+        "stages": [stage["stage"] for stage in stages],
+        "indexes": [stage["indexName"] for stage in stages if "indexName" in stage],
+        "collection_scan": any(stage["stage"] == "COLLSCAN" for stage in stages),
+    }
+
+# Listing and export
+# Newest first; `id` breaks ties so every row has a unique position for keyset paging
+CUSTOMER_LIST_SORT = [("created_at", DESCENDING), ("id", DESCENDING)]
+EXPORT_FIELDS = list(CustomerResponse.model_fields)
+# Fetch only what CustomerResponse needs; documents read this way are already
+# response-shaped and are sent with ORJSONResponse instead of re-validated
+CUSTOMER_RESPONSE_FIELDS = list(CustomerResponse.model_fields)
+CUSTOMER_RESPONSE_PROJECTION = {"_id": 0, **{field: 1 for field in CUSTOMER_RESPONSE_FIELDS}}
+# Full customer documents, without the internal search and uniqueness keys
+CUSTOMER_DOCUMENT_PROJECTION = {
+    "_id": 0, "search_keys": 0, "profile_search_keys": 0, "email_key": 0, "phone_key": 0, "idempotency_key": 0,
+}
+# What GET /api/customers/{account_number}/profile returns: the customer and its profile
+CUSTOMER_PROFILE_FIELDS = CUSTOMER_RESPONSE_FIELDS + [
+    field for field in CustomerProfile.model_fields if field not in CUSTOMER_RESPONSE_FIELDS
+]
+
+def customer_response_fields(customer: dict) -> dict:
+    """The CustomerResponse subset of a full customer document"""
+    return normalize_customer({field: customer.get(field) for field in CUSTOMER_RESPONSE_FIELDS})
+
+def customer_profile_fields(customer: dict) -> dict:
+    """The customer and profile fields of a full customer document"""
+    return normalize_customer({field: customer.get(field) for field in CUSTOMER_PROFILE_FIELDS})
+
+def customer_filter(customer_type: Optional[str], profile_completed: Optional[bool]) -> dict:
+    """Build the customers query for the list/export filters"""
+    query = {}
+    if customer_type:
+        query["customer_type"] = customer_type
+    if profile_completed is not None:
+        query["profile_completed"] = profile_completed
+    return query
+
+def encode_cursor(customer: dict) -> str:
+    """Opaque page cursor pointing just past `customer` in list order"""
+    position = {"created_at": customer["created_at"].isoformat(), "id": customer["id"]}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a page cursor into its (created_at, id) position"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(position["created_at"]), position["id"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_filter(query: dict, position: tuple) -> dict:
+    """Restrict a list query to the rows that sort after `position`"""
+    created_at, customer_id = position
+    return {
+        **query,
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": customer_id}},
+        ],
+    }
+
+def json_default(value):
+    """Serialize the non-JSON types stored in customer documents"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+async def export_chunks(query: dict, export_format: str):
+    """Stream matching customers as NDJSON or CSV, one batch per chunk"""
+    cursor = (
+        read_customers().find(query, CUSTOMER_RESPONSE_PROJECTION)
+        .sort(CUSTOMER_LIST_SORT)
+        .batch_size(EXPORT_BATCH_SIZE)
+    )
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    if export_format == "csv":
+        writer.writeheader()
+    
+    rows = 0
+    async for customer in cursor:
+        normalize_customer(customer)
+        if export_format == "csv":
+            writer.writerow({field: json_default(value) if value is not None else "" for field, value in customer.items()})
+        else:
+            buffer.write(json.dumps(customer, default=json_default))
+            buffer.write("\n")
+        rows += 1
+        if rows % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue()
+
+# Bulk import
+def validation_errors(error: ValidationError) -> List[dict]:
+    """JSON-safe summary of a model validation error"""
+    return [{"loc": list(err["loc"]), "msg": err["msg"]} for err in error.errors()]
+
+def write_error_rows(error: BulkWriteError, rows: List[int]) -> Dict[int, str]:
+    """Map the write errors of an unordered bulk write back to input rows"""
+    return {
+        rows[err["index"]]: f"Duplicate {duplicate_key_field(err)}" if err.get("code") == 11000 else err["errmsg"]
+        for err in error.details.get("writeErrors", [])
+    }
+
+def validate_rows(rows: List[dict], model) -> tuple:
+    """Validate raw rows against a model, returning (valid, errors)"""
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ROWS} rows per request")
+    valid, errors = [], []
+    for row_number, row in enumerate(rows):
+        try:
+            valid.append((row_number, model.model_validate(row)))
+        except ValidationError as e:
+            errors.append({"row": row_number, "errors": validation_errors(e)})
+    return valid, errors
+
+async def read_csv_rows(file: UploadFile) -> List[dict]:
+    """Parse an uploaded CSV file into rows, treating empty cells as missing"""
+    content = (await file.read()).decode("utf-8-sig")
+    return [
+        {column: value for column, value in row.items() if value not in ("", None)}
+        for row in csv.DictReader(io.StringIO(content))
+    ]
+
+async def bulk_signup(rows: List[dict]) -> dict:
+    """Validate and insert many signups with one number reservation per counter"""
+    valid, errors = validate_rows(rows, CustomerSignup)
+    
+    # Reserve a contiguous range of account numbers per counter
+    by_counter: Dict[str, list] = {}
+    for row_number, customer in valid:
+        by_counter.setdefault(account_counter_name(customer.customer_type), []).append((row_number, customer))
+    
+    documents, document_rows = [], []
+    for counter, group in by_counter.items():
+        start = await sequences.reserve(counter, len(group))
+        for offset, (row_number, customer) in enumerate(group):
+            account_number = generate_account_number(customer.customer_type, start + offset)
+            documents.append(build_customer_document(customer, account_number))
+            document_rows.append(row_number)
+    
+    failed: Dict[int, str] = {}
+    if documents:
+        try:
+            await db.customers.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            failed = write_error_rows(e, document_rows)
+    
+    created, inserted_by_type = [], {}
+    for row_number, document in zip(document_rows, documents):
+        if row_number in failed:
+            errors.append({"row": row_number, "errors": [{"loc": [], "msg": failed[row_number]}]})
+            continue
+        created.append({"row": row_number, "account_number": document["account_number"]})
+        inserted_by_type[document["customer_type"]] = inserted_by_type.get(document["customer_type"], 0) + 1
+        event_feed.publish("signup", customer_response_fields(document), signup_stats_delta(document["customer_type"]))
+    
+    for customer_type, count in inserted_by_type.items():
+        await record_signup_stats(customer_type, count)
+    
+    return {
+        "received": len(rows),
+        "created": len(created),
+        "failed": len(errors),
+        "customers": sorted(created, key=lambda item: item["row"]),
+        "errors": sorted(errors, key=lambda item: item["row"]),
+    }
+
+async def bulk_complete_profiles(rows: List[dict]) -> dict:
+    """Validate and apply many profiles with one lookup and one bulk write"""
+    valid, errors = validate_rows(rows, CustomerProfile)
+    
+    # Each account may appear once per batch
+    seen, unique = set(), []
+    for row_number, profile in valid:
+        if profile.account_number in seen:
+            errors.append({"row": row_number, "errors": [{"loc": ["account_number"], "msg": "Duplicate account number in batch"}]})
+            continue
+        seen.add(profile.account_number)
+        unique.append((row_number, profile))
+    
+    # Look every customer up in one query
+    customers = {}
+    if seen:
+        cursor = db.customers.find(
+            {"account_number": {"$in": list(seen)}},
+            {"_id": 0, "account_number": 1, "customer_type": 1, "profile_completed": 1, "customer_profile_number": 1},
+        )
+        async for customer in cursor:
+            customers[customer["account_number"]] = customer
+    
+    # Reserve profile numbers for first-time completions, per counter
+    pending: Dict[str, list] = {}
+    found = []
+    for row_number, profile in unique:
+        customer = customers.get(profile.account_number)
+        if customer is None:
+            errors.append({"row": row_number, "errors": [{"loc": ["account_number"], "msg": "Customer not found"}]})
+            continue
+        found.append((row_number, profile, customer))
+        if not customer.get("profile_completed"):
+            pending.setdefault(profile_counter_name(customer["customer_type"]), []).append(customer)
+    
+    for counter, group in pending.items():
+        start = await sequences.reserve(counter, len(group))
+        for offset, customer in enumerate(group):
+            customer["customer_profile_number"] = generate_profile_number(customer["customer_type"], start + offset)
+    
+    def profile_update(profile: CustomerProfile, customer: dict) -> UpdateOne:
+        query = {"account_number": profile.account_number}
+        if not customer.get("profile_completed"):
+            # Matches nothing if a concurrent completion issued a number first
+            query["profile_completed"] = {"$ne": True}
+        return UpdateOne(query, {"$set": build_profile_fields(profile, customer["customer_profile_number"])})
+    
+    operations = [profile_update(profile, customer) for _, profile, customer in found]
+    operation_rows = [row_number for row_number, _, _ in found]
+    
+    failed: Dict[int, str] = {}
+    if operations:
+        try:
+            matched = (await db.customers.bulk_write(operations, ordered=False)).matched_count
+        except BulkWriteError as e:
+            failed = write_error_rows(e, operation_rows)
+            matched = e.details.get("nMatched", 0)
+        
+        if matched < len(operations) - len(failed):
+            # Some completions lost a race: keep the number the winner issued
+            # and apply those rows as resubmissions
+            new = {
+                profile.account_number: (row_number, profile, customer)
+                for row_number, profile, customer in found
+                if not customer.get("profile_completed") and row_number not in failed
+            }
+            cursor = db.customers.find(
+                {"account_number": {"$in": list(new)}},
+                {"_id": 0, "account_number": 1, "customer_profile_number": 1},
+            )
+            retries, retry_rows = [], []
+            async for stored in cursor:
+                row_number, profile, customer = new[stored["account_number"]]
+                if stored.get("customer_profile_number") != customer["customer_profile_number"]:
+                    customer.update(stored, profile_completed=True)
+                    retries.append(profile_update(profile, customer))
+                    retry_rows.append(row_number)
+            if retries:
+                try:
+                    await db.customers.bulk_write(retries, ordered=False)
+                except BulkWriteError as e:
+                    failed.update(write_error_rows(e, retry_rows))
+    
+    completed, newly_completed = [], 0
+    for row_number, profile, customer in found:
+        if row_number in failed:
+            errors.append({"row": row_number, "errors": [{"loc": [], "msg": failed[row_number]}]})
+            continue
+        completed.append({
+            "row": row_number,
+            "account_number": profile.account_number,
+            "customer_profile_number": customer["customer_profile_number"],
+        })
+        if not customer.get("profile_completed"):
+            newly_completed += 1
+            event_feed.publish(
+                "profile_completed",
+                {
+                    "account_number": profile.account_number,
+                    "customer_profile_number": customer["customer_profile_number"],
+                    "profile_completed": True,
+                },
+                {"completed_profiles": 1},
+            )
+    
+    if newly_completed:
+        await record_profile_completion_stats(newly_completed)
+    await customer_cache.invalidate(*[profile.account_number for _, profile, _ in found])
+    if completed:
+        await segment_counts.invalidate()
+    
+    return {
+        "received": len(rows),
+        "completed": len(completed),
+        "failed": len(errors),
+        "profiles": sorted(completed, key=lambda item: item["row"]),
+        "errors": sorted(errors, key=lambda item: item["row"]),
+    }
+
+# Customer statistics
+STATS_DOCUMENT_ID = "customers"
+STATS_COUNTERS = [
+    "total_customers",
+    "subscription_customers",
+    "non_subscription_customers",
+    "corporate_customers",
+    "completed_profiles",
+]
+
+def stats_type_field(customer_type: str) -> Optional[str]:
+    """Stats counter that tracks a customer type, if it has one"""
+    if customer_type in ACCOUNT_NUMBER_PREFIXES:
+        return f"{customer_type}_customers"
+    return None
+
+def format_stats(counters: dict) -> dict:
+    """Build the /api/stats payload from raw counters"""
+    stats = {field: counters.get(field, 0) for field in STATS_COUNTERS}
+    total_customers = stats["total_customers"]
+    completed_profiles = stats["completed_profiles"]
+    stats["profile_completion_rate"] = (completed_profiles / total_customers * 100) if total_customers > 0 else 0
+    return stats
+
+async def compute_stats(primary: bool = False) -> dict:
+    """Compute the stats counters from scratch in a single aggregation pass
+
+    Counters that are written back (seeding, repair) are counted on the
+    primary: a lagging secondary would store its stale counts.
+    """
+    counters = {field: 0 for field in STATS_COUNTERS}
+    pipeline = [
+        {"$group": {
+            "_id": "$customer_type",
+            "total": {"$sum": 1},
+            "completed": {"$sum": {"$cond": ["$profile_completed", 1, 0]}},
+        }}
+    ]
+    customers = db.customers if primary else read_customers()
+    async for row in customers.aggregate(pipeline):
+        counters["total_customers"] += row["total"]
+        counters["completed_profiles"] += row["completed"]
+        type_field = stats_type_field(row["_id"])
+        if type_field:
+            counters[type_field] += row["total"]
+    return counters
+
+async def load_materialized_stats() -> dict:
+    """Read the stats document, building it from an aggregation if it is missing"""
+    counters = await db.stats.find_one({"_id": STATS_DOCUMENT_ID})
+    if counters is None:
+        counters = await compute_stats(primary=True)
+        # $setOnInsert so a document created concurrently is never clobbered
+        await db.stats.update_one(
+            {"_id": STATS_DOCUMENT_ID},
+            {"$setOnInsert": counters},
+            upsert=True,
+        )
+    return counters
+
+def signup_stats_delta(customer_type: str, count: int = 1) -> dict:
+    """Stats counters moved by new signups"""
+    increments = {"total_customers": count}
+    type_field = stats_type_field(customer_type)
+    if type_field:
+        increments[type_field] = count
+    return increments
+
+async def record_signup_stats(customer_type: str, count: int = 1):
+    """Count new signups in the stats document"""
+    # No upsert: a missing document is rebuilt from scratch on the next read
+    await db.stats.update_one({"_id": STATS_DOCUMENT_ID}, {"$inc": signup_stats_delta(customer_type, count)})
+
+async def record_profile_completion_stats(count: int = 1):
+    """Count newly completed profiles in the stats document"""
+    await db.stats.update_one({"_id": STATS_DOCUMENT_ID}, {"$inc": {"completed_profiles": count}})
+
+# Birthday calendar
+BIRTHDAY_SORT = [("birthday_md", ASCENDING)]
+BIRTHDAY_PROJECTION = {
+    "_id": 0,
+    "account_number": 1,
+    "customer_profile_number": 1,
+    "customer_type": 1,
+    "name": 1,
+    "email": 1,
+    "phone_number": 1,
+    "birthday_md": 1,
+    "profile_completed": 1,
+    "preferred_contact_method": 1,
+}
+
+def birthday_ranges(start: date, days: int) -> List[tuple]:
+    """Month-day ranges covering `days` days from `start`, split at the year end"""
+    first = birthday_month_day(start)
+    if days >= 366:
+        return [(first, 1231), (101, first - 1)] if first > 101 else [(101, 1231)]
+    end = start + timedelta(days=days - 1)
+    last = birthday_month_day(end)
+    # Feb 29 birthdays are celebrated on Feb 28 outside leap years
+    if last == 228 and not calendar.isleap(end.year):
+        last = 229
+    if end.year == start.year:
+        return [(first, last)]
+    return [(first, 1231), (101, last)]
+
+def next_birthday(month_day: int, start: date) -> date:
+    """First occurrence of a month-day on or after `start`"""
+    month, day = divmod(month_day, 100)
+    for year in (start.year, start.year + 1):
+        if month == 2 and day == 29 and not calendar.isleap(year):
+            candidate = date(year, 2, 28)
+        else:
+            candidate = date(year, month, day)
+        if candidate >= start:
+            return candidate
+    return candidate
+
+async def upcoming_birthdays(
+    start: date,
+    days: int,
+    query: Optional[dict] = None,
+    projection: Optional[dict] = None,
+    limit: int = 0,
+):
+    """Yield customers whose birthday falls in the window, in calendar order
+
+    Every range is an index range scan on `birthday_md`, so the cost depends
+    on the number of matches, not on the collection size.
+    """
+    remaining = limit
+    for low, high in birthday_ranges(start, days):
+        cursor = db.customers.find(
+            {**(query or {}), "birthday_md": {"$gte": low, "$lte": high}},
+            projection or BIRTHDAY_PROJECTION,
+        ).sort(BIRTHDAY_SORT)
+        if limit:
+            cursor = cursor.limit(remaining)
+        async for customer in cursor:
+            yield customer
+            remaining -= 1
+        if limit and remaining <= 0:
+            return
+
+def derived_birthday_fields(customer: dict) -> dict:
+    """`birthday_md` of a stored customer document"""
+    return {"birthday_md": birthday_month_day(customer.get("birthday_date") or customer["date_of_birth"])}
+
+def schema_v2_fields(customer: dict) -> dict:
+    """Fields that bring a version 1 document to version 2"""
+    date_of_birth = read_date(customer["date_of_birth"])
+    birthday = read_date(customer.get("birthday_date")) or date_of_birth
+    fields = {
+        "date_of_birth": stored_date(date_of_birth),
+        "birth_month": birthday.month,
+        "birth_day": birthday.day,
+        "birthday_md": birthday_month_day(birthday),
+        "schema_version": 2,
+    }
+    if customer.get("birthday_date") is not None:
+        fields["birthday_date"] = stored_date(birthday)
+    return fields
+
+async def migrate_schema_v2():
+    """Rewrite version 1 documents to version 2 in batches
+
+    Progress (the last `_id` done) is checkpointed in the migrations
+    collection, so a restart resumes where the previous run stopped. Each
+    update only applies if the dates are still the ones read, so a document
+    changed meanwhile is left for the next pass instead of being overwritten.
+    """
+    state = await db.migrations.find_one({"_id": "schema_v2"}) or {}
+    if state.get("completed_at"):
+        return
+    last_id = state.get("last_id")
+    migrated = state.get("migrated", 0)
+    skipped = 0
+    while True:
+        query = {"schema_version": {"$ne": 2}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        cursor = db.customers.find(query, {"date_of_birth": 1, "birthday_date": 1}).sort("_id", ASCENDING).limit(BACKFILL_BATCH_SIZE)
+        batch = await cursor.to_list(length=BACKFILL_BATCH_SIZE)
+        if not batch:
+            if skipped:
+                # Another pass for the documents that changed while being migrated
+                last_id, skipped = None, 0
+                continue
+            break
+        operations = [
+            UpdateOne(
+                {
+                    "_id": customer["_id"],
+                    "date_of_birth": customer["date_of_birth"],
+                    "birthday_date": customer.get("birthday_date", {"$exists": False}),
+                },
+                {"$set": schema_v2_fields(customer)},
+            )
+            for customer in batch
+        ]
+        result = await db.customers.bulk_write(operations, ordered=False)
+        migrated += result.modified_count
+        skipped += len(operations) - result.matched_count
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"_id": "schema_v2"},
+            {"$set": {"last_id": last_id, "migrated": migrated, "updated_at": datetime.utcnow()},
+             "$setOnInsert": {"started_at": datetime.utcnow()}},
+            upsert=True,
+        )
+    await db.migrations.update_one(
+        {"_id": "schema_v2"},
+        {"$set": {"migrated": migrated, "completed_at": datetime.utcnow()}, "$setOnInsert": {"started_at": datetime.utcnow()}},
+        upsert=True,
+    )
+    if migrated:
+        logger.info("Migrated %d customers to schema version 2", migrated)
+
+async def backfill_derived_fields(field: str, source_fields: List[str], derive):
+    """Add fields computed by `derive` to documents written before `field` existed
+
+    Each update only applies if the source fields are still the ones read, so
+    fresh values written meanwhile are never overwritten with stale ones; a
+    document changed meanwhile is left for the next pass. Documents whose
+    derived values violate a unique index are logged and left as they are.
+    """
+    updated = 0
+    skipped = 0
+    last_id = None
+    while True:
+        query = {field: {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        cursor = db.customers.find(query, {source: 1 for source in source_fields}).sort("_id", ASCENDING).limit(BACKFILL_BATCH_SIZE)
+        batch = await cursor.to_list(length=BACKFILL_BATCH_SIZE)
+        if not batch:
+            if skipped:
+                # Another pass for the documents that changed while being backfilled
+                last_id, skipped = None, 0
+                continue
+            break
+        last_id = batch[-1]["_id"]
+        updates = [(customer, derive(customer)) for customer in batch]
+        updates = [(customer, fields) for customer, fields in updates if fields]
+        if not updates:
+            continue
+        operations = [
+            UpdateOne(
+                {
+                    "_id": customer["_id"],
+                    field: {"$exists": False},
+                    **{source: customer.get(source, {"$exists": False}) for source in source_fields},
+                },
+                {"$set": fields},
+            )
+            for customer, fields in updates
+        ]
+        try:
+            result = await db.customers.bulk_write(operations, ordered=False)
+            matched, errors = result.matched_count, []
+        except BulkWriteError as e:
+            matched, errors = e.details.get("nMatched", 0), e.details.get("writeErrors", [])
+            for error in errors:
+                logger.warning("Could not backfill %s on customer %s: %s", field, updates[error["index"]][0]["_id"], error["errmsg"])
+        updated += matched
+        skipped += len(operations) - matched - len(errors)
+    if updated:
+        logger.info("Backfilled %s on %d customers", field, updated)
+
+# Birthday campaigns
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """Take tokens if available; otherwise return the seconds until they will be"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0
+        return (tokens - self.tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1):
+        """Wait until tokens are available and take them"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+class StubSender:
+    """Sender that logs and keeps messages instead of delivering them (local testing)
+
+    Real senders implement the same `async send(recipient, message)` method
+    and are installed with `campaign_scheduler.senders[channel] = sender`.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.sent = deque(maxlen=1000)
+
+    async def send(self, recipient: dict, message: str):
+        self.sent.append({"account_number": recipient["account_number"], "message": message})
+        logger.info("[%s] %s: %s", self.channel, recipient["account_number"], message)
+
+CAMPAIGN_CHANNELS = ["email", "sms", "phone", "whatsapp"]
+# `preferred_contact_method` values of the profile form -> channel
+CONTACT_METHOD_CHANNELS = {"email": "email", "text": "sms", "phone": "phone", "whatsapp": "whatsapp"}
+CAMPAIGN_PROJECTION = {
+    **BIRTHDAY_PROJECTION,
+    "contact_name": 1,
+    "email_address": 1,
+    "interest_in_rewards": 1,
+    "want_corporate_offers": 1,
+    "i_like_surprises": 1,
+}
+# Completed profiles that opted into something a birthday message can offer
+CAMPAIGN_AUDIENCE = {
+    "profile_completed": True,
+    "$or": [
+        {"interest_in_rewards": True},
+        {"i_like_surprises": True},
+        {"customer_type": "corporate", "want_corporate_offers": True},
+    ],
+}
+
+def campaign_channel(contact_method: Optional[str]) -> str:
+    """Channel a customer is reached on, CAMPAIGN_FALLBACK_CHANNEL for unknown methods"""
+    return CONTACT_METHOD_CHANNELS.get(contact_method or "", CAMPAIGN_FALLBACK_CHANNEL)
+
+def reclaimable_delivery(now: datetime) -> dict:
+    """Deliveries a new run may claim again: failed, or pending for too long"""
+    return {
+        "$or": [
+            {"status": "failed"},
+            {"status": "pending", "claimed_at": {"$lt": now - timedelta(seconds=CAMPAIGN_CLAIM_TIMEOUT_SECONDS)}},
+        ],
+        "attempts": {"$not": {"$gte": CAMPAIGN_MAX_ATTEMPTS}},
+    }
+
+def birthday_message(customer: dict, birthday: date) -> str:
+    """Birthday outreach text tailored to the customer's preferences"""
+    name = customer.get("contact_name") or customer["name"]
+    parts = [f"Happy birthday, {name}! We are celebrating you on {birthday:%B %d}."]
+    if customer.get("interest_in_rewards"):
+        parts.append("Your birthday reward is waiting for you at the bistro.")
+    if customer.get("i_like_surprises"):
+        parts.append("We are preparing a little surprise for your visit.")
+    if customer.get("customer_type") == "corporate" and customer.get("want_corporate_offers"):
+        parts.append("Ask us about our corporate celebration packages.")
+    return " ".join(parts)
+
+class CampaignScheduler:
+    """Background worker that sends birthday outreach ahead of each birthday
+
+    Runs every CAMPAIGN_INTERVAL_SECONDS: pulls upcoming birthdays in batches,
+    groups recipients by `preferred_contact_method` and sends through the
+    channel's sender, rate limited per channel and with bounded concurrency.
+    Every delivery is claimed in `campaign_deliveries` (one per customer and
+    birthday) before it is sent, so a restart never sends a message twice.
+    Failed deliveries are claimed again by later runs; so are pending ones
+    after CAMPAIGN_CLAIM_TIMEOUT_SECONDS, which resends a message only if a
+    run crashed between sending it and recording it.
+    """
+
+    def __init__(self):
+        self.senders = {channel: StubSender(channel) for channel in CAMPAIGN_CHANNELS}
+        self.buckets = {}
+        self.concurrency = asyncio.Semaphore(CAMPAIGN_CONCURRENCY)
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+        self.last_result: Optional[dict] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _loop(self):
+        while True:
+            # A failing iteration (MongoDB unreachable, ...) is logged and retried, never ends the task
+            try:
+                state = await db.campaign_state.find_one({"_id": "birthday"}) or {}
+                last_run_at = state.get("last_run_at")
+                if last_run_at:
+                    delay = CAMPAIGN_INTERVAL_SECONDS - (datetime.utcnow() - last_run_at).total_seconds()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await self.run_once()
+            except Exception:
+                logger.exception("Birthday campaign run failed")
+                await asyncio.sleep(CAMPAIGN_INTERVAL_SECONDS)
+
+    async def run_once(self, start: Optional[date] = None) -> dict:
+        """Send outreach for every birthday in the next CAMPAIGN_LEAD_DAYS days"""
+        async with self.lock:
+            start = start or datetime.utcnow().date()
+            result = {"started_at": datetime.utcnow(), "sent": 0, "failed": 0, "skipped": 0}
+            batch = []
+            async for customer in upcoming_birthdays(start, CAMPAIGN_LEAD_DAYS, CAMPAIGN_AUDIENCE, CAMPAIGN_PROJECTION):
+                batch.append(customer)
+                if len(batch) >= CAMPAIGN_BATCH_SIZE:
+                    await self._send_batch(batch, start, result)
+                    batch = []
+            if batch:
+                await self._send_batch(batch, start, result)
+            
+            result["finished_at"] = datetime.utcnow()
+            await db.campaign_state.update_one(
+                {"_id": "birthday"},
+                {"$set": {"last_run_at": result["finished_at"], "last_result": result}},
+                upsert=True,
+            )
+            self.last_result = result
+            logger.info("Birthday campaign sent %(sent)d, failed %(failed)d, skipped %(skipped)d", result)
+            return result
+
+    async def _send_batch(self, batch: List[dict], start: date, result: dict):
+        # Claim every delivery first; customers claimed by an earlier run are skipped
+        now = datetime.utcnow()
+        claims = []
+        for customer in batch:
+            birthday = next_birthday(customer["birthday_md"], start)
+            claims.append({
+                "_id": f"{birthday.year}:{customer['account_number']}",
+                "account_number": customer["account_number"],
+                "birthday": birthday.isoformat(),
+                "channel": campaign_channel(customer.get("preferred_contact_method")),
+                "status": "pending",
+                "claimed_at": now,
+                "attempts": 1,
+            })
+        try:
+            await db.campaign_deliveries.insert_many(claims, ordered=False)
+            claimed = set(range(len(claims)))
+        except BulkWriteError as e:
+            taken = write_error_rows(e, list(range(len(claims))))
+            reclaimed = await self._reclaim([claims[index] for index in taken], now)
+            claimed = {index for index in range(len(claims)) if index not in taken or claims[index]["_id"] in reclaimed}
+        result["skipped"] += len(claims) - len(claimed)
+        
+        # Group by channel and send
+        by_channel: Dict[str, list] = {}
+        for index in sorted(claimed):
+            by_channel.setdefault(claims[index]["channel"], []).append((batch[index], claims[index]))
+        
+        outcomes = []
+        for channel, recipients in by_channel.items():
+            outcomes.extend(await asyncio.gather(*[
+                self._deliver(channel, customer, claim) for customer, claim in recipients
+            ]))
+        
+        operations = []
+        for claim, error in outcomes:
+            status = "failed" if error else "sent"
+            result[status] += 1
+            operations.append(UpdateOne(
+                {"_id": claim["_id"]},
+                {"$set": {"status": status, "error": error, "finished_at": datetime.utcnow()}},
+            ))
+        if operations:
+            await db.campaign_deliveries.bulk_write(operations, ordered=False)
+
+    async def _reclaim(self, claims: List[dict], now: datetime) -> set:
+        """Take over the retryable ones of deliveries claimed before; the ids taken"""
+        retryable = {
+            row["_id"]
+            async for row in db.campaign_deliveries.find(
+                {"_id": {"$in": [claim["_id"] for claim in claims]}, **reclaimable_delivery(now)}, {"_id": 1}
+            )
+        }
+        reclaimed = set()
+        for claim in claims:
+            if claim["_id"] not in retryable:
+                continue
+            # Conditional, so of two runs racing for a delivery only one wins it
+            taken = await db.campaign_deliveries.update_one(
+                {"_id": claim["_id"], **reclaimable_delivery(now)},
+                {
+                    "$set": {"channel": claim["channel"], "status": "pending", "claimed_at": now},
+                    "$inc": {"attempts": 1},
+                },
+            )
+            if taken.modified_count:
+                reclaimed.add(claim["_id"])
+        return reclaimed
+
+    async def _deliver(self, channel: str, customer: dict, claim: dict) -> tuple:
+        sender = self.senders.get(channel)
+        if sender is None:
+            return claim, f"No sender for channel {channel!r}"
+        bucket = self.buckets.setdefault(channel, TokenBucket(CAMPAIGN_RATE_PER_SECOND, CAMPAIGN_RATE_PER_SECOND))
+        await bucket.acquire()
+        async with self.concurrency:
+            try:
+                await sender.send(customer, birthday_message(customer, date.fromisoformat(claim["birthday"])))
+                return claim, None
+            except Exception as e:
+                logger.warning("Sending birthday message to %s failed: %s", customer["account_number"], e)
+                return claim, str(e)
+
+campaign_scheduler = CampaignScheduler()
+
+# Segments
+def segment_conditions(segment: SegmentFilter) -> dict:
+    """Field conditions of a segment, in canonical form"""
+    conditions = {}
+    for field, value in segment.model_dump(exclude_none=True).items():
+        if isinstance(value, list):
+            value = sorted(set(value))
+            if len(value) == 1:
+                value = value[0]
+        conditions[field] = value
+    return conditions
+
+def segment_id(conditions: dict) -> str:
+    """Stable identifier of a segment's conditions"""
+    return hashlib.sha1(json.dumps(conditions, sort_keys=True).encode()).hexdigest()[:16]
+
+def segment_query(conditions: dict) -> dict:
+    """MongoDB filter selecting a segment's members"""
+    query = {"profile_completed": True}
+    for field, value in conditions.items():
+        query[field] = {"$in": value} if isinstance(value, list) else value
+    return query
+
+def segment_matches(conditions: dict, customer: Optional[dict]) -> bool:
+    """Whether a customer document belongs to a segment"""
+    if not customer or not customer.get("profile_completed"):
+        return False
+    for field, value in conditions.items():
+        if customer.get(field) not in (value if isinstance(value, list) else [value]):
+            return False
+    return True
+
+class SegmentCounts:
+    """Member counts of frequently queried segments, kept in `segment_counts`
+
+    Every segment that is queried is tracked (up to SEGMENT_MAX_TRACKED, the
+    most used first). Profile writes adjust the counts of the tracked segments
+    they enter or leave with `$inc`; counts older than SEGMENT_COUNT_TTL_SECONDS
+    or marked stale are recounted on the next read.
+    """
+
+    def __init__(self):
+        self._tracked: List[dict] = []
+        self._loaded_at = 0.0
+
+    async def tracked(self) -> List[dict]:
+        """Tracked segments, refreshed from the database every few seconds"""
+        if time.monotonic() - self._loaded_at > SEGMENT_TRACKED_REFRESH_SECONDS:
+            cursor = db.segment_counts.find({}, {"conditions": 1}).sort("hits", DESCENDING).limit(SEGMENT_MAX_TRACKED)
+            self._tracked = await cursor.to_list(length=SEGMENT_MAX_TRACKED)
+            self._loaded_at = time.monotonic()
+        return self._tracked
+
+    async def count(self, conditions: dict) -> tuple:
+        """Member count of a segment and whether it came from the tracked counts"""
+        key = segment_id(conditions)
+        tracked = await db.segment_counts.find_one_and_update(
+            {"_id": key},
+            {"$inc": {"hits": 1}, "$set": {"last_used_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if (
+            tracked is not None
+            and not tracked.get("stale")
+            and (datetime.utcnow() - tracked["refreshed_at"]).total_seconds() < SEGMENT_COUNT_TTL_SECONDS
+        ):
+            return tracked["count"], "tracked"
+        
+        # On the primary: the stored count is then only moved by $inc deltas
+        count = await db.customers.count_documents(segment_query(conditions))
+        await db.segment_counts.update_one(
+            {"_id": key},
+            {
+                "$set": {"conditions": conditions, "count": count, "refreshed_at": datetime.utcnow(), "stale": False},
+                "$setOnInsert": {"hits": 1, "last_used_at": datetime.utcnow()},
+            },
+            upsert=True,
+        )
+        if tracked is None:
+            self._loaded_at = 0.0  # pick the new segment up on the next write
+        return count, "computed"
+
+    async def apply_change(self, before: Optional[dict], after: Optional[dict]):
+        """Move a customer between tracked segment counts after a write"""
+        operations = []
+        for segment in await self.tracked():
+            delta = segment_matches(segment["conditions"], after) - segment_matches(segment["conditions"], before)
+            if delta:
+                operations.append(UpdateOne({"_id": segment["_id"]}, {"$inc": {"count": delta}}))
+        if operations:
+            await db.segment_counts.bulk_write(operations, ordered=False)
+
+    async def invalidate(self):
+        """Force every tracked count to be recomputed (after bulk writes)"""
+        await db.segment_counts.update_many({}, {"$set": {"stale": True}})
+
+segment_counts = SegmentCounts()
+
+# Customer search
+PHONE_QUERY = re.compile(r"\+?[\d\s().-]+")
+
+def fold(text: str) -> str:
+    """Lowercase `text` and strip accents"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+def email_key(email: Optional[str]) -> Optional[str]:
+    """Email address in the form two customers may not share"""
+    return fold(email.strip()) if email else None
+
+def phone_key(phone_number: Optional[str]) -> Optional[str]:
+    """Digits of a phone number, which two customers may not share"""
+    return re.sub(r"\D", "", phone_number or "") or None
+
+def contact_keys(email: Optional[str], phone_number: Optional[str]) -> dict:
+    """Normalized contact fields the unique indexes are on"""
+    keys = {"email_key": email_key(email), "phone_key": phone_key(phone_number)}
+    return {field: key for field, key in keys.items() if key is not None}
+
+def name_words(text: Optional[str]) -> List[str]:
+    """Normalized words of a name"""
+    return re.findall(r"[a-z0-9]+", fold(text or ""))
+
+def single_deletions(word: str) -> set:
+    """`word` with each of its characters removed in turn"""
+    return {word[:index] + word[index + 1:] for index in range(len(word))}
+
+def search_keys(name: Optional[str], email: Optional[str], phone_number: Optional[str]) -> List[str]:
+    """Normalized, indexed keys a customer can be found by
+
+    Name words, the email address and the phone digits are matched by prefix.
+    Keys starting with "~" are the name words with one character deleted: a
+    query word shares one of them (or the word itself) with every stored word
+    at most one typo away from it.
+    """
+    keys = set()
+    for word in name_words(name):
+        keys.add(word)
+        if len(word) >= 4:
+            keys.update(f"~{deletion}" for deletion in single_deletions(word))
+    if email:
+        keys.add(email_key(email))
+    digits = phone_key(phone_number)
+    if digits:
+        keys.add(digits)
+        # Without the country code, as it is usually typed
+        keys.add(digits[-10:])
+    return sorted(keys)
+
+def profile_search_keys(profile_data: dict) -> List[str]:
+    """Search keys of the contact details given in a profile"""
+    return search_keys(profile_data.get("contact_name"), profile_data.get("email_address"), profile_data.get("phone_number"))
+
+def derived_contact_keys(customer: dict) -> dict:
+    """Unique contact keys of a stored customer document"""
+    return contact_keys(customer.get("email"), customer.get("phone_number"))
+
+def derived_search_fields(customer: dict) -> dict:
+    """Search keys of a stored customer document"""
+    fields = {"search_keys": search_keys(customer.get("name"), customer.get("email"), customer.get("phone_number"))}
+    if customer.get("profile_completed"):
+        fields["profile_search_keys"] = profile_search_keys(customer)
+    return fields
+
+def search_terms(query: str) -> List[str]:
+    """Normalize a search query the same way as the stored keys"""
+    if PHONE_QUERY.fullmatch(query.strip()) and any(char.isdigit() for char in query):
+        # A phone number typed with spaces is still one number
+        return [re.sub(r"\D", "", query)]
+    terms = []
+    for part in query.split():
+        if "@" in part:
+            terms.append(fold(part))
+        elif PHONE_QUERY.fullmatch(part) and any(char.isdigit() for char in part):
+            terms.append(re.sub(r"\D", "", part))
+        else:
+            terms.extend(name_words(part))
+    return terms
+
+def search_filter(terms: List[str], fuzzy: bool) -> dict:
+    """Customers matching every term, on their signup or on their profile details"""
+    conditions = []
+    for term in terms:
+        if fuzzy and len(term) >= 4 and term.isalpha():
+            # Stored words one insertion, deletion or substitution away from the term
+            deletions = single_deletions(term)
+            conditions.append({"$in": sorted({term, f"~{term}"} | deletions | {f"~{deletion}" for deletion in deletions})})
+        else:
+            # Anchored, case-sensitive regexes are index range scans
+            conditions.append({"$regex": f"^{re.escape(term)}"})
+    return {"$or": [
+        {"$and": [{field: condition} for condition in conditions]}
+        for field in ("search_keys", "profile_search_keys")
+    ]}
+
+def search_score(terms: List[str], customer: dict) -> float:
+    """How well a customer's keys match the query terms (1.0 is an exact match)"""
+    keys = [key for key in customer.get("search_keys", []) + customer.get("profile_search_keys", []) if not key.startswith("~")]
+    score = 0.0
+    for term in terms:
+        best = 0.0
+        for key in keys:
+            if key == term:
+                best = 1.0
+                break
+            if key.startswith(term):
+                best = max(best, 0.9)
+            else:
+                best = max(best, 0.8 * difflib.SequenceMatcher(None, term, key[:len(term) + 1]).ratio())
+        score += best
+    return score / len(terms)
+
+async def search_customers(query: str, limit: int) -> List[dict]:
+    """Customers matching a partial name, email or phone number, best match first"""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    projection = {**CUSTOMER_RESPONSE_PROJECTION, "search_keys": 1, "profile_search_keys": 1}
+    candidates: Dict[str, dict] = {}
+    for fuzzy in (False, True):
+        cursor = (
+            db.customers.find(search_filter(terms, fuzzy), projection)
+            .limit(SEARCH_MAX_CANDIDATES)
+            .max_time_ms(SEARCH_MAX_TIME_MS)
+        )
+        async for customer in cursor:
+            candidates.setdefault(customer["account_number"], customer)
+        # Typo-tolerant matching only when prefixes found too little
+        if len(candidates) >= limit:
+            break
+    ranked = sorted(candidates.values(), key=lambda customer: (-search_score(terms, customer), customer["name"]))
+    return [customer_response_fields(customer) for customer in ranked[:limit]]
+
+# Event feed
+# Sent when a client cannot be resumed where it left off; it should reload
+RESET_EVENT = {"id": None, "event": "reset", "data": {}}
+
+# Inserts, and the update that completes a profile
+CHANGE_STREAM_PIPELINE = [{"$match": {"$or": [
+    {"operationType": "insert"},
+    {"operationType": "update", "updateDescription.updatedFields.profile_completed": True},
+]}}]
+
+class EventBroker:
+    """In-process pub/sub keeping the last events for reconnecting clients
+
+    Event ids are "<process>-<sequence>": ids of another process (e.g. before
+    a restart) or older than the buffer cannot be resumed from.
+    """
+
+    def __init__(self, size: int):
+        self.process_id = uuid.uuid4().hex[:8]
+        self.sequence = 0
+        self.buffer: deque = deque(maxlen=size)
+        self.subscribers: set = set()
+
+    def publish(self, event_type: str, data: dict):
+        self.sequence += 1
+        event = {"id": f"{self.process_id}-{self.sequence}", "event": event_type, "data": data}
+        self.buffer.append((self.sequence, event))
+        for queue in list(self.subscribers):
+            if queue.qsize() >= self.buffer.maxlen:
+                # Too far behind: end its stream, it reconnects from its last id
+                self.subscribers.discard(queue)
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(event)
+
+    def replay(self, last_event_id: Optional[str]) -> Optional[list]:
+        """Buffered events after `last_event_id`, or None if some were dropped"""
+        if not last_event_id:
+            return []
+        process_id, _, sequence = last_event_id.partition("-")
+        if process_id != self.process_id or not sequence.isdigit():
+            return None
+        oldest = self.buffer[0][0] if self.buffer else self.sequence + 1
+        if int(sequence) < oldest - 1:
+            return None
+        return [event for position, event in self.buffer if position > int(sequence)]
+
+    def close(self):
+        """End every open stream"""
+        for queue in self.subscribers:
+            queue.put_nowait(None)
+        self.subscribers.clear()
+
+    async def subscribe(self, last_event_id: Optional[str]):
+        """Events after `last_event_id`, then live ones; None is a keepalive"""
+        backlog = self.replay(last_event_id)
+        queue: asyncio.Queue = asyncio.Queue()
+        self.subscribers.add(queue)
+        try:
+            if backlog is None:
+                yield RESET_EVENT
+                backlog = []
+            for event in backlog:
+                yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENT_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    return
+                yield event
+        finally:
+            self.subscribers.discard(queue)
+
+def event_from_change(change: dict) -> Optional[dict]:
+    """Feed event of a customers change stream document"""
+    customer = change.get("fullDocument")
+    if customer is None:
+        # Deleted before the update could be looked up
+        return None
+    if change["operationType"] == "insert":
+        event_type, stats_delta = "signup", signup_stats_delta(customer["customer_type"])
+    else:
+        event_type, stats_delta = "profile_completed", {"completed_profiles": 1}
+    return {
+        "id": change["_id"]["_data"],
+        "event": event_type,
+        "data": {"customer": customer_response_fields(customer), "stats_delta": stats_delta},
+    }
+
+class EventFeed:
+    """Signup and profile completion events, with the stats counters they move
+
+    On a replica set every client follows its own change stream, so it sees
+    the writes of every process and resumes from its last resume token.
+    Otherwise this process publishes its own writes to an in-process broker.
+    """
+
+    def __init__(self):
+        self.broker = EventBroker(EVENT_BUFFER_SIZE)
+        self.source: Optional[str] = None
+        self.clients = 0
+        self.closing = False
+
+    async def start(self):
+        self.closing = False
+        self.source = EVENT_SOURCE
+        if self.source == "auto":
+            try:
+                hello = await client.admin.command("hello")
+                replicated = "setName" in hello or hello.get("msg") == "isdbgrid"
+            except Exception:
+                replicated = False
+            self.source = "change_stream" if replicated else "memory"
+        logger.info("Event feed source: %s", self.source)
+
+    def close(self):
+        self.closing = True
+        self.broker.close()
+
+    def publish(self, event_type: str, customer: dict, stats_delta: dict):
+        """Publish a write made by this process (change streams see writes themselves)"""
+        if self.source == "memory":
+            self.broker.publish(event_type, {"customer": customer, "stats_delta": stats_delta})
+
+    async def events(self, last_event_id: Optional[str]):
+        """Events after `last_event_id`, then live ones; None is a keepalive"""
+        if self.source == "change_stream":
+            stream = self.change_stream(last_event_id)
+        else:
+            stream = self.broker.subscribe(last_event_id)
+        deadline = time.monotonic() + EVENT_STREAM_MAX_SECONDS
+        async with aclosing(stream):
+            # Keepalives come at least every EVENT_KEEPALIVE_SECONDS, so the deadline is checked that often
+            async for event in stream:
+                yield event
+                if time.monotonic() >= deadline:
+                    return
+
+    async def change_stream(self, last_event_id: Optional[str]):
+        resume_after = {"_data": last_event_id} if last_event_id else None
+        while not self.closing:
+            try:
+                async with db.customers.watch(
+                    CHANGE_STREAM_PIPELINE,
+                    full_document="updateLookup",
+                    resume_after=resume_after,
+                    max_await_time_ms=int(EVENT_KEEPALIVE_SECONDS * 1000),
+                ) as stream:
+                    while not self.closing:
+                        change = await stream.try_next()
+                        if change is None:
+                            yield None
+                            continue
+                        resume_after = change["_id"]
+                        event = event_from_change(change)
+                        if event:
+                            yield event
+            except OperationFailure:
+                if resume_after is None:
+                    raise
+                # Unknown token, or no longer in the oplog: continue from now
+                resume_after = None
+                yield RESET_EVENT
+
+def format_sse(event: Optional[dict]) -> str:
+    """Encode an event (None for a keepalive comment) as a server-sent event"""
+    if event is None:
+        return ": keepalive\n\n"
+    lines = [f"id: {event['id']}"] if event["id"] else []
+    lines.append(f"event: {event['event']}")
+    lines.append(f"data: {orjson.dumps(event['data']).decode()}")
+    return "\n".join(lines) + "\n\n"
+
+event_feed = EventFeed()
+
+# Write-behind signups
+class SignupBuffer:
+    """Queue of acknowledged signups written to MongoDB in batches
+
+    A signup is journaled (when SIGNUP_JOURNAL_PATH is set), queued and
+    acknowledged; a background task inserts the queue with `insert_many`.
+    Stats, events and the customer cache follow once a batch is written.
+    Duplicate emails or phone numbers are only detected then: those signups
+    are logged and counted as rejected.
+    """
+
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.pending: Dict[str, tuple] = {}  # account_number -> (document, future)
+        self.task: Optional[asyncio.Task] = None
+        self.journal = None
+        self.journal_path = ""
+        self.journal_writes = 0
+        self.journal_synced = 0
+        self.journal_sync: Optional[asyncio.Task] = None
+        self.closing = False
+        self.flush_latency = LatencyHistogram()
+        self.documents = {"inserted": 0, "rejected": 0}
+        self.flush_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.task is not None and not self.closing
+
+    async def start(self):
+        self.closing = False
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(SIGNUP_BUFFER_MAX_DOCS)
+        self.wakeup = asyncio.Event()
+        self.journal_path = signup_journal_path()
+        if self.journal_path:
+            self.journal = open(self.journal_path, "ab")
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write everything still queued, then stop"""
+        if self.task is None:
+            return
+        self.closing = True
+        self.wakeup.set()
+        await self.task
+        self.task = None
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    async def add(self, document: dict):
+        """Journal and queue a signup document; waits while the buffer is full"""
+        try:
+            await asyncio.wait_for(self.slots.acquire(), SIGNUP_BACKPRESSURE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Signup buffer is full", headers={"Retry-After": "1"})
+        if self.journal:
+            self.journal.write(orjson.dumps(document) + b"\n")
+            self.journal.flush()
+            self.journal_writes += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[document["account_number"]] = (document, future)
+        self.queue.put_nowait(document)
+        if self.queue.qsize() >= SIGNUP_FLUSH_SIZE:
+            self.wakeup.set()
+        if self.journal and SIGNUP_JOURNAL_FSYNC:
+            await self._sync_journal(self.journal_writes)
+
+    async def _sync_journal(self, writes: int):
+        """Wait until the first `writes` journal lines are on disk
+
+        Concurrent signups share one fsync (group commit) instead of each
+        waiting for their own.
+        """
+        while self.journal_synced < writes:
+            if self.journal_sync is None:
+                self.journal_sync = asyncio.create_task(self._fsync_journal())
+            await asyncio.shield(self.journal_sync)
+
+    async def _fsync_journal(self):
+        writes = self.journal_writes
+        try:
+            await asyncio.to_thread(os.fsync, self.journal.fileno())
+            self.journal_synced = writes
+        finally:
+            self.journal_sync = None
+
+    async def wait_until_written(self, account_number: str):
+        """Flush now if a signup for this account is still queued, and wait for it"""
+        entry = self.pending.get(account_number)
+        if entry is not None:
+            self.wakeup.set()
+            await asyncio.shield(entry[1])
+
+    async def _run(self):
+        while not (self.closing and self.queue.empty()):
+            if self.queue.qsize() < SIGNUP_FLUSH_SIZE and not self.closing:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), SIGNUP_FLUSH_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+            self.wakeup.clear()
+            batch = [self.queue.get_nowait() for _ in range(min(self.queue.qsize(), SIGNUP_FLUSH_SIZE))]
+            if batch:
+                try:
+                    await self._write(batch)
+                except Exception:
+                    logger.exception("Writing %d buffered signups failed", len(batch))
+                    self._release(batch, written=False)
+
+    async def _write(self, documents: List[dict]):
+        started = time.perf_counter()
+        failed: Dict[int, str] = {}
+        attempt = 0
+        while True:
+            try:
+                await db.customers.insert_many(documents, ordered=False)
+                failed = {}
+            except BulkWriteError as e:
+                failed = write_error_rows(e, list(range(len(documents))))
+                if attempt:
+                    # Written by the attempt that failed midway
+                    failed = {index: error for index, error in failed.items() if error != "Duplicate account_number"}
+            except PyMongoError as e:
+                self.flush_errors += 1
+                if not self.closing:
+                    attempt += 1
+                    logger.warning("Buffered signup flush failed (attempt %d): %s", attempt, e)
+                    await asyncio.sleep(min(30, 0.5 * 2 ** attempt))
+                    continue
+                logger.error("Dropping %d buffered signups at shutdown (journal: %s): %s",
+                             len(documents), self.journal_path or "disabled", e)
+                self._release(documents, written=False)
+                return
+            break
+        self.flush_latency.observe(time.perf_counter() - started)
+        
+        inserted_by_type: Dict[str, int] = {}
+        for index, document in enumerate(documents):
+            document.pop("_id", None)
+            if index in failed:
+                self.documents["rejected"] += 1
+                logger.warning("Buffered signup %s rejected: %s", document["account_number"], failed[index])
+                await customer_cache.invalidate(document["account_number"])
+                continue
+            self.documents["inserted"] += 1
+            inserted_by_type[document["customer_type"]] = inserted_by_type.get(document["customer_type"], 0) + 1
+            event_feed.publish("signup", customer_response_fields(document), signup_stats_delta(document["customer_type"]))
+        for customer_type, count in inserted_by_type.items():
+            await record_signup_stats(customer_type, count)
+        self._release(documents, written=True, failed=failed)
+
+    def _release(self, documents: List[dict], written: bool, failed: Optional[dict] = None):
+        for index, document in enumerate(documents):
+            entry = self.pending.pop(document["account_number"], None)
+            if entry is None:
+                continue
+            entry[1].set_result(written and index not in (failed or {}))
+            self.slots.release()
+        if self.journal and written:
+            self._compact_journal()
+
+    def _compact_journal(self):
+        """Drop written signups from the journal"""
+        if not self.pending:
+            self.journal.seek(0)
+            self.journal.truncate()
+        elif self.journal.tell() > SIGNUP_JOURNAL_COMPACT_BYTES:
+            self.journal.close()
+            with open(self.journal_path + ".tmp", "wb") as f:
+                for document, _ in self.pending.values():
+                    f.write(orjson.dumps(document) + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.journal_path + ".tmp", self.journal_path)
+            self.journal = open(self.journal_path, "ab")
+
+def signup_journal_path(worker_index: Optional[int] = None) -> str:
+    """Journal of a worker: SIGNUP_JOURNAL_PATH, suffixed with the worker index when there are several"""
+    if not SIGNUP_JOURNAL_PATH or WORKER_COUNT == 1:
+        return SIGNUP_JOURNAL_PATH
+    return f"{SIGNUP_JOURNAL_PATH}.{WORKER_INDEX if worker_index is None else worker_index}"
+
+def signup_journals_to_replay() -> List[str]:
+    """This worker's journal; worker 0 also takes over those no current worker owns
+
+    (left behind by a run with a different number of workers)
+    """
+    if not SIGNUP_JOURNAL_PATH:
+        return []
+    paths = [signup_journal_path()]
+    if WORKER_INDEX == 0:
+        owned = {signup_journal_path(index) for index in range(WORKER_COUNT)}
+        candidates = [SIGNUP_JOURNAL_PATH] + sorted(
+            path for path in glob.glob(glob.escape(SIGNUP_JOURNAL_PATH) + ".*")
+            if path[len(SIGNUP_JOURNAL_PATH) + 1:].isdigit()
+        )
+        paths += [path for path in candidates if path not in owned]
+    return paths
+
+async def replay_signup_journal(path: str):
+    """Insert signups left in a journal by a previous run
+
+    Signups that were written before the run ended fail with a duplicate
+    account number and are skipped, so replaying is idempotent.
+    """
+    if not os.path.exists(path):
+        return
+    documents = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                document = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # A write torn by a crash was never acknowledged
+                logger.warning("Skipping an unreadable line in %s", path)
+                continue
+            for field in ("created_at", "updated_at", "date_of_birth"):
+                document[field] = datetime.fromisoformat(document[field])
+            documents.append(document)
+    
+    replayed = 0
+    for start in range(0, len(documents), SIGNUP_FLUSH_SIZE):
+        batch = documents[start:start + SIGNUP_FLUSH_SIZE]
+        failed: Dict[int, str] = {}
+        try:
+            await db.customers.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            failed = write_error_rows(e, list(range(len(batch))))
+        inserted_by_type: Dict[str, int] = {}
+        for index, document in enumerate(batch):
+            if index in failed:
+                if failed[index] != "Duplicate account_number":
+                    logger.warning("Journaled signup %s rejected: %s", document["account_number"], failed[index])
+                continue
+            replayed += 1
+            inserted_by_type[document["customer_type"]] = inserted_by_type.get(document["customer_type"], 0) + 1
+        for customer_type, count in inserted_by_type.items():
+            await record_signup_stats(customer_type, count)
     
-    # Count existing customers of this type with completed profiles
-    count = await collection.count_documents({
-        "customer_type": customer_type,
-        "profile_completed": True
-    })
-    return generate_profile_number(customer_type, count + 1)
+    os.truncate(path, 0)
+    logger.info("Replayed %d of %d journaled signups from %s", replayed, len(documents), path)
+
+signup_buffer = SignupBuffer()
+buffered_sequences = SequenceAllocator(SIGNUP_SEQUENCE_BLOCK_SIZE)
+
+# Customer cache
+class MemoryCacheBackend:
+    """In-process LRU cache whose entries expire after a TTL"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+class RedisCacheBackend:
+    """Cache shared by every process through Redis (requires the `redis` package)"""
+
+    def __init__(self, url: str, ttl_seconds: float):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package")
+        self.redis = redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+
+    async def get(self, key: str):
+        value = await self.redis.get(key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: dict):
+        await self.redis.set(key, json.dumps(value, default=json_default), px=int(self.ttl_seconds * 1000))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.redis.delete(*keys)
+
+    def stats(self) -> dict:
+        return {"backend": "redis"}
+
+class CustomerCache:
+    """Read-through cache of customer documents keyed by account number"""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(account_number: str) -> str:
+        return f"customer:{account_number}"
+
+    async def get(self, account_number: str) -> Optional[dict]:
+        if self.backend is None:
+            return None
+        customer = await self.backend.get(self.key(account_number))
+        if customer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return customer
+
+    async def set(self, customer: dict):
+        if self.backend is not None:
+            await self.backend.set(self.key(customer["account_number"]), customer)
+
+    async def invalidate(self, *account_numbers: str):
+        if self.backend is not None and account_numbers:
+            self.invalidations += len(account_numbers)
+            await self.backend.delete(*[self.key(account_number) for account_number in account_numbers])
+
+    def stats(self) -> dict:
+        if self.backend is None:
+            return {"backend": "none"}
+        lookups = self.hits + self.misses
+        return {
+            **self.backend.stats(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0,
+            "invalidations": self.invalidations,
+        }
+
+def create_cache_backend(name: str):
+    """Build the cache backend selected by CACHE_BACKEND"""
+    if name == "memory" and WORKER_COUNT > 1:
+        # Another worker's writes would never reach this process's entries
+        if WORKER_INDEX == 0:
+            logger.warning("CACHE_BACKEND=memory is per process: customer caching is off with %d workers, "
+                           "use CACHE_BACKEND=redis to cache across them", WORKER_COUNT)
+        return None
+    if name == "memory":
+        return MemoryCacheBackend(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+    if name == "redis":
+        return RedisCacheBackend(REDIS_URL, CACHE_TTL_SECONDS)
+    return None
+
+customer_cache = CustomerCache(create_cache_backend(CACHE_BACKEND))
+
+# Rate limiting and admission control
+class MemoryRateLimitBackend:
+    """One token bucket per client in this process, least recently seen evicted first"""
+
+    def __init__(self, rate: float, capacity: float, max_clients: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_clients = max_clients
+        self.buckets: OrderedDict = OrderedDict()
+
+    async def acquire(self, key: str, cost: float) -> float:
+        bucket = self.buckets.pop(key, None) or TokenBucket(self.rate, self.capacity)
+        self.buckets[key] = bucket
+        if len(self.buckets) > self.max_clients:
+            self.buckets.popitem(last=False)
+        return bucket.try_acquire(cost)
+
+class RedisRateLimitBackend:
+    """Token buckets shared by every process through Redis (requires the `redis` package)"""
+
+    # Refill, take `cost` tokens if there are enough, and return the wait in
+    # seconds otherwise; atomic, and timed by the Redis clock
+    SCRIPT = """
+    local now = redis.call('TIME')
+    now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+    local rate, capacity, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    local wait = 0
+    if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+    return tostring(wait)
+    """
+
+    def __init__(self, url: str, rate: float, capacity: float):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package")
+        self.redis = redis.from_url(url)
+        self.script = self.redis.register_script(self.SCRIPT)
+        self.rate = rate
+        self.capacity = capacity
+
+    async def acquire(self, key: str, cost: float) -> float:
+        wait = await self.script(keys=[f"ratelimit:{key}"], args=[self.rate, self.capacity, cost])
+        return float(wait)
+
+class RateLimiter:
+    """Per-client token buckets in front of the write endpoints"""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.limited = 0
+
+    async def check(self, client_key: str, cost: float = 1):
+        """Take `cost` tokens for the client or reject the request with a 429"""
+        if self.backend is None:
+            return
+        # A request costing more than the burst could never pass
+        wait = await self.backend.acquire(client_key, min(cost, self.backend.capacity))
+        if wait > 0:
+            self.limited += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+class AdmissionControl:
+    """Cap on concurrent write requests; beyond it requests are shed, not queued"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.shed = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.in_flight >= self.limit:
+            self.shed += 1
+            raise HTTPException(status_code=429, detail="Server is busy", headers={"Retry-After": "1"})
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+def create_rate_limit_backend(name: str):
+    """Build the rate limit backend selected by RATE_LIMIT_BACKEND"""
+    if name == "memory":
+        return MemoryRateLimitBackend(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST, RATE_LIMIT_MAX_CLIENTS)
+    if name == "redis":
+        return RedisRateLimitBackend(REDIS_URL, RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST)
+    return None
+
+def client_key(request: Request) -> str:
+    """Who a request is rate limited as: a known API key, else the client IP"""
+    api_key = request.headers.get("X-API-Key")
+    if api_key and api_key in RATE_LIMIT_API_KEYS:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    if TRUST_FORWARDED_FOR and request.headers.get("X-Forwarded-For"):
+        return "ip:" + request.headers["X-Forwarded-For"].split(",")[0].strip()
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+def write_limits(cost: float = 1):
+    """Dependency applying the client's rate limit and the write concurrency cap"""
+    async def dependency(request: Request):
+        await rate_limiter.check(client_key(request), cost)
+        async with write_admission.slot():
+            yield
+    return dependency
+
+rate_limiter = RateLimiter(create_rate_limit_backend(RATE_LIMIT_BACKEND))
+write_admission = AdmissionControl(MAX_CONCURRENT_WRITES)
+
+async def load_customer(account_number: str) -> Optional[dict]:
+    """Fetch a customer document (without `_id`) through the cache"""
+    customer = await customer_cache.get(account_number)
+    if customer is None:
+        customer = await db.customers.find_one({"account_number": account_number}, CUSTOMER_DOCUMENT_PROJECTION)
+        if customer is not None:
+            await customer_cache.set(customer)
+    return normalize_customer(customer) if customer is not None else None
+
+background_tasks: List[asyncio.Task] = []
+
+# Fields derived from others, with the fields they are computed from
+DERIVED_FIELDS = [
+    ("birthday_md", ["date_of_birth", "birthday_date"], derived_birthday_fields),
+    ("search_keys", ["name", "email", "phone_number", "profile_completed", "contact_name", "email_address"], derived_search_fields),
+    ("email_key", ["email", "phone_number"], derived_contact_keys),
+]
+
+async def backfill_all_derived_fields():
+    """Backfill every derived field, one after the other"""
+    for field, source_fields, derive in DERIVED_FIELDS:
+        await backfill_derived_fields(field, source_fields, derive)
+
+def configure_worker(index: int, count: int):
+    """Turn a process forked from the preloaded app into worker `index` of `count`
+
+    Module state built at import time is copied into every worker. It holds
+    no customers, tokens or number blocks until the app starts serving, so
+    only what identifies the process, and what must not stay per process,
+    has to change here.
+    """
+    global WORKER_INDEX, WORKER_COUNT
+    WORKER_INDEX, WORKER_COUNT = index, count
+    customer_cache.backend = create_cache_backend(CACHE_BACKEND)
+    # Event ids must not collide between workers
+    event_feed.broker.process_id = uuid.uuid4().hex[:8]
+
+async def startup():
+    """Prepare indexes and counters before serving requests"""
+    await ensure_indexes()
+    for path in signup_journals_to_replay():
+        await replay_signup_journal(path)
+    await seed_sequences()
+    await event_feed.start()
+    if SIGNUP_WRITE_BEHIND:
+        await signup_buffer.start()
+    if WORKER_INDEX == 0:
+        background_tasks.append(asyncio.create_task(backfill_all_derived_fields()))
+        background_tasks.append(asyncio.create_task(migrate_schema_v2()))
+        if CAMPAIGN_SCHEDULER_ENABLED:
+            campaign_scheduler.start()
+
+async def shutdown():
+    """Stop background work"""
+    await signup_buffer.stop()
+    event_feed.close()
+    await campaign_scheduler.stop()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
 
 # API Routes
 @app.get("/api/health")
@@ -120,80 +2664,237 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "birthday-club-api"}
 
-@app.post("/api/customers/signup", response_model=CustomerResponse)
-async def customer_signup(customer: CustomerSignup):
-    """Initial customer signup with 4 basic fields"""
+@app.get("/api/health/ready")
+async def readiness_check():
+    """Readiness probe: ping MongoDB and report connection pool utilization"""
+    pool = {
+        "max_pool_size": MONGO_MAX_POOL_SIZE,
+        "open_connections": pool_listener.open,
+        "checked_out": pool_listener.checked_out,
+        "utilization": pool_listener.checked_out / MONGO_MAX_POOL_SIZE if MONGO_MAX_POOL_SIZE else 0,
+        "check_out_failures": pool_listener.check_out_failures,
+    }
+    started = time.perf_counter()
     try:
-        # Generate account number
-        account_number = await get_next_account_number(customer.customer_type)
-        
-        # Create customer document
-        customer_doc = {
-            "id": str(uuid.uuid4()),
-            "account_number": account_number,
-            "customer_profile_number": None,
-            "customer_type": customer.customer_type,
-            "name": customer.name,
-            "email": customer.email,
-            "phone_number": customer.phone_number,
-            "date_of_birth": customer.date_of_birth.isoformat(),  # Convert to string
-            "profile_completed": False,
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
+        await db.command("ping")
+    except PyMongoError as e:
+        return ORJSONResponse(
+            {"status": "unavailable", "service": "birthday-club-api", "database": str(e), "pool": pool},
+            status_code=503,
+        )
+    return {
+        "status": "ready",
+        "service": "birthday-club-api",
+        "database": {"ping_ms": (time.perf_counter() - started) * 1000},
+        "pool": pool,
+    }
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request latency and MongoDB usage in the Prometheus text format"""
+    return render_metrics()
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Hit/miss/eviction counters of the customer cache"""
+    return customer_cache.stats()
+
+@app.get("/api/admin/migrations")
+async def get_migrations():
+    """Progress of the background data migrations"""
+    try:
+        migrations = await db.migrations.find({}).to_list(length=None)
+        pending = await db.customers.count_documents({"schema_version": {"$ne": SCHEMA_VERSION}})
+        return ORJSONResponse({
+            "schema_version": SCHEMA_VERSION,
+            "documents_behind": pending,
+            "migrations": [
+                {"name": migration.pop("_id"), **migration, "last_id": str(migration.get("last_id"))}
+                for migration in migrations
+            ],
+        })
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/admin/query-plans")
+async def get_query_plans():
+    """Report index build status and the query plan of every route's query"""
+    try:
+        plans = []
+        for shape in route_query_shapes():
+            try:
+                plans.append(await explain_route_query(shape))
+            except Exception as e:
+                plans.append({"route": shape["route"], "error": str(e)})
+        
+        return {
+            "indexes": index_status,
+            "plans": plans,
+            "collection_scans": [plan["route"] for plan in plans if plan.get("collection_scan")],
         }
         
-        # Insert into database
-        result = await db.customers.insert_one(customer_doc)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/customers/signup", response_model=CustomerResponse, dependencies=[Depends(write_limits())])
+async def customer_signup(
+    customer: CustomerSignup,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Initial customer signup with 4 basic fields
+
+    Retries that send the same `Idempotency-Key` header return the customer
+    created by the first attempt. Duplicates are detected by unique indexes
+    rather than a read before the insert, so parallel signups cannot race.
+    With SIGNUP_WRITE_BEHIND, signups without an Idempotency-Key are
+    acknowledged with 202 before they are written.
+    """
+    try:
+        if signup_buffer.enabled and not idempotency_key:
+            count = await buffered_sequences.next(account_counter_name(customer.customer_type))
+            customer_doc = build_customer_document(customer, generate_account_number(customer.customer_type, count))
+            await signup_buffer.add(customer_doc)
+            response = customer_response_fields(customer_doc)
+            await customer_cache.set(response)
+            return ORJSONResponse(response, status_code=202)
         
-        if result.inserted_id:
-            return CustomerResponse(**customer_doc)
+        for _ in range(3):
+            # Generate account number
+            account_number = await get_next_account_number(customer.customer_type)
+            
+            # Create customer document
+            customer_doc = build_customer_document(customer, account_number)
+            if idempotency_key:
+                customer_doc["idempotency_key"] = idempotency_key
+            
+            # Insert into database
+            try:
+                await db.customers.insert_one(customer_doc)
+                break
+            except DuplicateKeyError as e:
+                field = duplicate_key_field(e.details)
+                if field == "account_number":
+                    # Number issued outside the allocator; draw the next one
+                    continue
+                if field == "idempotency_key":
+                    original = await db.customers.find_one({"idempotency_key": idempotency_key}, CUSTOMER_DOCUMENT_PROJECTION)
+                    if original is None or original["email"] != customer_doc["email"]:
+                        raise HTTPException(status_code=409, detail="Idempotency-Key was used for a different signup")
+                    return CustomerResponse(**normalize_customer(original))
+                raise HTTPException(status_code=409, detail=f"A customer with this {field} already exists")
         else:
-            raise HTTPException(status_code=500, detail="Failed to create customer")
+            raise HTTPException(status_code=500, detail="Failed to allocate an account number")
+        
+        await record_signup_stats(customer.customer_type)
+        event_feed.publish("signup", customer_response_fields(customer_doc), signup_stats_delta(customer.customer_type))
+        customer_doc.pop("_id", None)
+        for field in ("search_keys", "email_key", "phone_key", "idempotency_key"):
+            customer_doc.pop(field, None)
+        await customer_cache.set(customer_doc)
+        return CustomerResponse(**normalize_customer(dict(customer_doc)))
             
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/customers/bulk/signup", dependencies=[Depends(write_limits(RATE_LIMIT_BULK_COST))])
+async def bulk_customer_signup(rows: List[Dict[str, Any]]):
+    """Sign up many customers from a JSON array, reporting errors per row"""
+    try:
+        return await bulk_signup(rows)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/customers/bulk/signup/csv", dependencies=[Depends(write_limits(RATE_LIMIT_BULK_COST))])
+async def bulk_customer_signup_csv(file: UploadFile = File(...)):
+    """Sign up many customers from an uploaded CSV file, reporting errors per row"""
+    try:
+        return await bulk_signup(await read_csv_rows(file))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/customers/bulk/profile", dependencies=[Depends(write_limits(RATE_LIMIT_BULK_COST))])
+async def bulk_customer_profile(rows: List[Dict[str, Any]]):
+    """Complete many customer profiles from a JSON array, reporting errors per row"""
+    try:
+        return await bulk_complete_profiles(rows)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/customers/{account_number}/profile")
+@app.post("/api/customers/bulk/profile/csv", dependencies=[Depends(write_limits(RATE_LIMIT_BULK_COST))])
+async def bulk_customer_profile_csv(file: UploadFile = File(...)):
+    """Complete many customer profiles from an uploaded CSV file, reporting errors per row"""
+    try:
+        return await bulk_complete_profiles(await read_csv_rows(file))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/customers/{account_number}/profile", response_model=CustomerResponse, dependencies=[Depends(write_limits())])
 async def complete_customer_profile(account_number: str, profile: CustomerProfile):
-    """Complete detailed customer profile with 20 fields"""
+    """Complete detailed customer profile with 20 fields
+
+    The customer is read through the cache. Resubmitting a completed profile
+    is idempotent and costs one write; a first completion draws the profile
+    number (only for a customer that exists and has no profile yet) and
+    applies it in one conditional update.
+    """
     try:
-        # Find customer by account number
-        customer = await db.customers.find_one({"account_number": account_number})
+        await signup_buffer.wait_until_written(account_number)
         
-        if not customer:
+        existing = await load_customer(account_number)
+        if existing is None:
             raise HTTPException(status_code=404, detail="Customer not found")
         
-        # Generate profile number if not already completed
-        if not customer.get("profile_completed"):
-            profile_number = await get_next_profile_number(customer["customer_type"])
-        else:
-            profile_number = customer.get("customer_profile_number")
-        
-        # Update customer with profile information
-        profile_data = profile.dict()
-        profile_data["customer_profile_number"] = profile_number
-        profile_data["profile_completed"] = True
-        profile_data["updated_at"] = datetime.utcnow()
-        # Convert date to string for MongoDB
-        if "birthday_date" in profile_data:
-            profile_data["birthday_date"] = profile_data["birthday_date"].isoformat()
-        
-        # Update database
-        result = await db.customers.update_one(
-            {"account_number": account_number},
-            {"$set": profile_data}
-        )
+        # Already completed: update in place and return the result
+        resubmission = None
+        if existing.get("profile_completed"):
+            resubmission = await resubmit_profile(account_number, profile)
         
-        if result.modified_count:
-            # Return updated customer
-            updated_customer = await db.customers.find_one({"account_number": account_number})
-            if updated_customer:
-                return CustomerResponse(**updated_customer)
+        if resubmission is None:
+            new_phone = phone_key(profile.phone_number)
+            if ENFORCE_UNIQUE_CONTACT and new_phone and new_phone != phone_key(existing.get("phone_number")):
+                # Refuse before a profile number is drawn for nothing
+                if await db.customers.find_one({"phone_key": new_phone, "account_number": {"$ne": account_number}}, {"_id": 1}):
+                    raise HTTPException(status_code=409, detail="A customer with this phone_number already exists")
+            
+            count = await sequences.next(profile_counter_name(existing["customer_type"]))
+            profile_number = generate_profile_number(existing["customer_type"], count)
+            
+            customer = await db.customers.find_one_and_update(
+                {"account_number": account_number, "profile_completed": {"$ne": True}},
+                {"$set": build_profile_fields(profile, profile_number)},
+                projection=CUSTOMER_DOCUMENT_PROJECTION,
+                return_document=ReturnDocument.AFTER,
+            )
+            if customer is not None:
+                await record_profile_completion_stats()
+                event_feed.publish("profile_completed", customer_response_fields(customer), {"completed_profiles": 1})
+                resubmission = (None, customer)
             else:
-                raise HTTPException(status_code=500, detail="Failed to retrieve updated customer")
-        else:
-            raise HTTPException(status_code=500, detail="Failed to update customer profile")
+                # Completed concurrently, or deleted (the number is skipped)
+                resubmission = await resubmit_profile(account_number, profile)
+                if resubmission is None:
+                    raise HTTPException(status_code=404, detail="Customer not found")
+        
+        before, customer = resubmission
+        await segment_counts.apply_change(before, customer)
+        await customer_cache.set(customer)
+        return CustomerResponse(**normalize_customer(dict(customer)))
             
+    except HTTPException:
+        raise
+    except DuplicateKeyError as e:
+        raise HTTPException(status_code=409, detail=f"A customer with this {duplicate_key_field(e.details)} already exists")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -202,23 +2903,74 @@ async def get_customers(
     customer_type: Optional[str] = None,
     profile_completed: Optional[bool] = None,
     limit: int = 50,
-    skip: int = 0
+    skip: int = 0,
+    cursor: Optional[str] = None
 ):
-    """Get customers with optional filtering"""
+    """Get customers with optional filtering
+
+    Pass the `X-Next-Cursor` response header back as `cursor` to fetch the next
+    page; cursor paging stays fast at any depth, unlike `skip`.
+    """
     try:
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        if cursor and skip:
+            raise HTTPException(status_code=400, detail="Use either cursor or skip, not both")
+        
         # Build query filters
-        query = {}
-        if customer_type:
-            query["customer_type"] = customer_type
-        if profile_completed is not None:
-            query["profile_completed"] = profile_completed
+        query = customer_filter(customer_type, profile_completed)
+        if cursor:
+            query = keyset_filter(query, decode_cursor(cursor))
         
         # Execute query
-        cursor = db.customers.find(query).skip(skip).limit(limit).sort("created_at", -1)
-        customers = await cursor.to_list(length=limit)
+        results = read_customers().find(query, CUSTOMER_RESPONSE_PROJECTION).sort(CUSTOMER_LIST_SORT).skip(skip).limit(limit)
+        customers = [normalize_customer(customer) for customer in await results.to_list(length=limit)]
+        
+        headers = {}
+        if len(customers) == limit:
+            headers["X-Next-Cursor"] = encode_cursor(customers[-1])
+        
+        return ORJSONResponse(customers, headers=headers)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/customers/export")
+async def export_customers(
+    format: str = "ndjson",
+    customer_type: Optional[str] = None,
+    profile_completed: Optional[bool] = None
+):
+    """Stream every matching customer as NDJSON or CSV"""
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_chunks(customer_filter(customer_type, profile_completed), format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="customers.{format}"'},
+    )
+
+@app.get("/api/customers/search", response_model=List[CustomerResponse])
+async def search(q: str, limit: int = 10):
+    """Find customers by partial name, contact name, email or phone number
+
+    Words match by prefix and, when that finds too little, with up to one
+    typo per word; every word of the query has to match.
+    """
+    try:
+        if not 1 <= limit <= SEARCH_MAX_RESULTS:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {SEARCH_MAX_RESULTS}")
+        if len(q.strip()) < 2:
+            raise HTTPException(status_code=400, detail="Search for at least 2 characters")
         
-        return [CustomerResponse(**customer) for customer in customers]
+        return ORJSONResponse(await search_customers(q, limit))
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -226,13 +2978,15 @@ async def get_customers(
 async def get_customer(account_number: str):
     """Get specific customer by account number"""
     try:
-        customer = await db.customers.find_one({"account_number": account_number})
+        customer = await load_customer(account_number)
         
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
         
-        return CustomerResponse(**customer)
+        return ORJSONResponse(customer_response_fields(customer))
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -240,7 +2994,7 @@ async def get_customer(account_number: str):
 async def get_customer_profile(account_number: str):
     """Get detailed customer profile"""
     try:
-        customer = await db.customers.find_one({"account_number": account_number})
+        customer = await load_customer(account_number)
         
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
@@ -248,33 +3002,226 @@ async def get_customer_profile(account_number: str):
         if not customer.get("profile_completed"):
             raise HTTPException(status_code=404, detail="Customer profile not completed")
         
-        return customer
+        return ORJSONResponse(customer_profile_fields(customer))
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/birthdays/upcoming")
+async def get_upcoming_birthdays(
+    days: int = 7,
+    start: Optional[date] = None,
+    customer_type: Optional[str] = None,
+    profile_completed: Optional[bool] = None,
+    limit: int = 100
+):
+    """Customers with a birthday in the next `days` days (from `start`, default today)"""
+    try:
+        if not 1 <= days <= 366:
+            raise HTTPException(status_code=400, detail="days must be between 1 and 366")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        
+        start = start or datetime.utcnow().date()
+        query = customer_filter(customer_type, profile_completed)
+        
+        customers = []
+        async for customer in upcoming_birthdays(start, days, query, limit=limit):
+            birthday = next_birthday(customer["birthday_md"], start)
+            customer["next_birthday"] = birthday.isoformat()
+            customer["days_until"] = (birthday - start).days
+            customers.append(customer)
+        
+        return {"start": start.isoformat(), "days": days, "count": len(customers), "customers": customers}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/campaigns/status")
+async def get_campaign_status():
+    """State of the birthday campaign scheduler and its last run"""
+    try:
+        state = await db.campaign_state.find_one({"_id": "birthday"}, {"_id": 0}) or {}
+        deliveries = {
+            row["_id"]: row["count"]
+            async for row in db.campaign_deliveries.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])
+        }
+        return {
+            "enabled": CAMPAIGN_SCHEDULER_ENABLED,
+            "running": campaign_scheduler.lock.locked(),
+            "last_run_at": state.get("last_run_at"),
+            "last_result": state.get("last_result"),
+            "deliveries": deliveries,
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/campaigns/run", status_code=202)
+async def run_campaign():
+    """Start a birthday campaign run in the background"""
+    if campaign_scheduler.lock.locked():
+        raise HTTPException(status_code=409, detail="A campaign run is already in progress")
+    task = asyncio.create_task(campaign_scheduler.run_once())
+    background_tasks.append(task)
+    task.add_done_callback(background_tasks.remove)
+    return {"status": "started"}
+
+@app.post("/api/segments/query")
+async def query_segment(request: SegmentQuery):
+    """Count and page through the members of a profile segment"""
+    try:
+        if not 1 <= request.limit <= MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        
+        conditions = segment_conditions(request.filter)
+        count, count_source = await segment_counts.count(conditions)
+        
+        query = segment_query(conditions)
+        if request.cursor:
+            query = keyset_filter(query, decode_cursor(request.cursor))
+        results = read_customers().find(query, CUSTOMER_RESPONSE_PROJECTION).sort(CUSTOMER_LIST_SORT).limit(request.limit)
+        members = [normalize_customer(member) for member in await results.to_list(length=request.limit)]
         
+        return ORJSONResponse({
+            "segment_id": segment_id(conditions),
+            "conditions": conditions,
+            "count": count,
+            "count_source": count_source,
+            "members": members,
+            "next_cursor": encode_cursor(members[-1]) if len(members) == request.limit else None,
+        })
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/segments")
+async def get_segments():
+    """Tracked segments with their counts, most used first"""
+    try:
+        cursor = db.segment_counts.find({}).sort("hits", DESCENDING).limit(SEGMENT_MAX_TRACKED)
+        segments = await cursor.to_list(length=SEGMENT_MAX_TRACKED)
+        return ORJSONResponse([{"segment_id": segment.pop("_id"), **segment} for segment in segments])
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/events")
+async def stream_events(
+    last_event_id: Optional[str] = None,
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """Server-sent events for signups and profile completions, with stats deltas
+
+    Browsers reconnect with the Last-Event-ID header and receive what they
+    missed; a "reset" event means that is no longer possible and the client
+    should reload its data.
+    """
+    if event_feed.clients >= EVENT_MAX_CLIENTS:
+        raise HTTPException(status_code=503, detail="Too many event feed clients")
+    
+    async def stream():
+        event_feed.clients += 1
+        try:
+            async for event in event_feed.events(last_event_id_header or last_event_id):
+                yield format_sse(event)
+        finally:
+            event_feed.clients -= 1
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/api/stats")
-async def get_stats():
-    """Get customer statistics"""
+async def get_stats(source: Optional[str] = None):
+    """Get customer statistics
+
+    `source=materialized` reads the incrementally maintained stats document,
+    `source=live` recomputes the counters with one aggregation pass.
+    """
+    try:
+        if source is None:
+            source = "materialized" if STATS_MATERIALIZED else "live"
+        if source == "materialized":
+            counters = await load_materialized_stats()
+        elif source == "live":
+            counters = await compute_stats()
+        else:
+            raise HTTPException(status_code=400, detail="source must be 'materialized' or 'live'")
+        
+        return format_stats(counters)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def stats_drift() -> tuple:
+    """Recount the stats counters and compare them with the stats document
+
+    Returns (live, materialized, drift), drift being materialized - live per
+    counter that differs.
+    """
+    materialized = await db.stats.find_one({"_id": STATS_DOCUMENT_ID}) or {}
+    live = await compute_stats(primary=True)
+    drift = {
+        field: materialized.get(field, 0) - live[field]
+        for field in STATS_COUNTERS
+        if materialized.get(field, 0) != live[field]
+    }
+    return live, materialized, drift
+
+@app.get("/api/stats/check")
+async def check_stats():
+    """Recompute the stats counters from scratch and report drift in the stats document"""
     try:
-        total_customers = await db.customers.count_documents({})
-        subscription_customers = await db.customers.count_documents({"customer_type": "subscription"})
-        non_subscription_customers = await db.customers.count_documents({"customer_type": "non_subscription"})
-        corporate_customers = await db.customers.count_documents({"customer_type": "corporate"})
-        completed_profiles = await db.customers.count_documents({"profile_completed": True})
+        live, materialized, drift = await stats_drift()
+        return {
+            "consistent": not drift,
+            "drift": drift,
+            "live": format_stats(live),
+            "materialized": format_stats(materialized),
+        }
         
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/stats/repair")
+async def repair_stats():
+    """Correct the stats document by the drift measured against a recount
+
+    The correction is applied with `$inc`, so counter updates made meanwhile
+    are kept. A signup between the two reads can still be counted in the
+    drift; run it while writes are quiet, and check again afterwards.
+    """
+    try:
+        live, materialized, drift = await stats_drift()
+        if drift:
+            await db.stats.update_one(
+                {"_id": STATS_DOCUMENT_ID},
+                {"$inc": {field: -difference for field, difference in drift.items()}},
+                upsert=True,
+            )
         return {
-            "total_customers": total_customers,
-            "subscription_customers": subscription_customers,
-            "non_subscription_customers": non_subscription_customers,
-            "corporate_customers": corporate_customers,
-            "completed_profiles": completed_profiles,
-            "profile_completion_rate": (completed_profiles / total_customers * 100) if total_customers > 0 else 0
+            "repaired": bool(drift),
+            "drift": drift,
+            "live": format_stats(live),
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
+    # One process; serve.py runs several worker processes for production
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    # Cancel requests still running after GRACEFUL_TIMEOUT_SECONDS so the
+    # lifespan shutdown (flushing buffered signups) always runs
+    uvicorn.run(app, host="0.0.0.0", port=8001, timeout_graceful_shutdown=GRACEFUL_TIMEOUT_SECONDS)
\ No newline at end of file
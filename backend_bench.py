@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Birthday Club Backend Benchmark Suite
+Runs server.py in-process against a local MongoDB (or mongomock-motor) and
+reports throughput and latency percentiles per endpoint
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import server  # noqa: E402
+
+ENDPOINTS = ["signup", "profile", "lookup", "list", "stats"]
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+    return ordered[index]
+
+
+class BirthdayClubBenchmark:
+    def __init__(self, requests: int = 200, concurrency: int = 20, mongo_url: Optional[str] = None):
+        self.requests = requests
+        self.concurrency = concurrency
+        self.mongo_url = mongo_url
+        self.account_numbers: List[str] = []
+        self.phone_numbers: Dict[str, str] = {}
+        self.results: Dict[str, dict] = {}
+
+    async def setup(self):
+        """Point the app at a fresh local database and run its startup hooks"""
+        if self.mongo_url:
+            from motor.motor_asyncio import AsyncIOMotorClient
+
+            server.client = AsyncIOMotorClient(self.mongo_url, event_listeners=[server.MongoCommandListener()])
+            server.db = server.client.birthday_club_bench
+            await server.client.drop_database("birthday_club_bench")
+        else:
+            try:
+                from mongomock_motor import AsyncMongoMockClient
+            except ImportError:
+                raise SystemExit("Install mongomock-motor or pass --mongo-url to benchmark against a local mongod")
+            server.client = AsyncMongoMockClient()
+            server.db = server.client.birthday_club_bench
+
+        # Every request comes from one client; measure the endpoints, not the rate limit
+        server.rate_limiter.backend = None
+        await server.startup()
+        if not self.mongo_url:
+            # mongomock ignores partialFilterExpression, which would make every
+            # document without the field collide on these unique indexes
+            for index in server.customer_indexes():
+                if "partialFilterExpression" in index.document:
+                    await server.db.customers.drop_index(index.document["name"])
+
+    async def teardown(self):
+        await server.shutdown()
+        if self.mongo_url:
+            await server.client.drop_database("birthday_club_bench")
+
+    async def run_phase(self, name: str, http: httpx.AsyncClient, make_request, count: int):
+        """Issue `count` requests with bounded concurrency and record their latency"""
+        latencies: List[float] = []
+        errors = 0
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(count):
+            queue.put_nowait(index)
+
+        async def worker():
+            nonlocal errors
+            while True:
+                try:
+                    index = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                started = time.perf_counter()
+                try:
+                    response = await make_request(http, index)
+                    ok = response.is_success
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+        elapsed = time.perf_counter() - started
+
+        self.results[name] = {
+            "requests": count,
+            "errors": errors,
+            "throughput_rps": count / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "max_ms": max(latencies, default=0.0) * 1000,
+        }
+
+    async def signup(self, http: httpx.AsyncClient, index: int) -> httpx.Response:
+        response = await http.post("/api/customers/signup", json={
+            "name": f"Bench Customer {index}",
+            "phone_number": f"+1555{index:07d}",
+            "email": f"bench_{index}@example.com",
+            "date_of_birth": f"1990-{index % 12 + 1:02d}-{index % 28 + 1:02d}",
+            "customer_type": ["subscription", "non_subscription", "corporate"][index % 3],
+        })
+        if response.is_success:
+            customer = response.json()
+            self.account_numbers.append(customer["account_number"])
+            self.phone_numbers[customer["account_number"]] = customer["phone_number"]
+        return response
+
+    async def profile(self, http: httpx.AsyncClient, index: int) -> httpx.Response:
+        account_number = self.account_numbers[index % len(self.account_numbers)]
+        return await http.post(f"/api/customers/{account_number}/profile", json={
+            "account_number": account_number,
+            "contact_name": f"Bench Contact {index}",
+            "email_address": f"bench_profile_{index}@example.com",
+            # Phone numbers are unique per customer, so keep the account's own
+            "phone_number": self.phone_numbers[account_number],
+            "birthday_date": f"1990-{index % 12 + 1:02d}-{index % 28 + 1:02d}",
+            "celebration_budget": "100_200",
+            "group_size_solo": "2_4",
+            "preferred_contact_method": "email",
+            "interest_in_rewards": True,
+        })
+
+    async def lookup(self, http: httpx.AsyncClient, index: int) -> httpx.Response:
+        account_number = self.account_numbers[index % len(self.account_numbers)]
+        return await http.get(f"/api/customers/{account_number}")
+
+    async def list_customers(self, http: httpx.AsyncClient, index: int) -> httpx.Response:
+        return await http.get("/api/customers", params={"limit": 50})
+
+    async def stats(self, http: httpx.AsyncClient, index: int) -> httpx.Response:
+        return await http.get("/api/stats")
+
+    async def run(self) -> dict:
+        """Run every phase in order and return the report"""
+        await self.setup()
+        try:
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as http:
+                await self.run_phase("signup", http, self.signup, self.requests)
+                if not self.account_numbers:
+                    raise SystemExit("No signup succeeded; nothing else to benchmark")
+                await self.run_phase("profile", http, self.profile, self.requests)
+                await self.run_phase("lookup", http, self.lookup, self.requests)
+                await self.run_phase("list", http, self.list_customers, self.requests)
+                await self.run_phase("stats", http, self.stats, self.requests)
+        finally:
+            await self.teardown()
+
+        return {
+            "created_at": datetime.utcnow().isoformat(),
+            "backend": "mongod" if self.mongo_url else "mongomock",
+            "requests": self.requests,
+            "concurrency": self.concurrency,
+            "endpoints": self.results,
+        }
+
+
+def serialization_benchmark(rows: int = 1000, repeat: int = 20) -> dict:
+    """Per-row cost of serializing a page of customers, before and after the fast path"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+
+    now = datetime.utcnow()
+    page = [
+        {
+            "id": f"00000000-0000-0000-0000-{index:012d}",
+            "account_number": f"SAN-{index:05d}",
+            "customer_profile_number": None,
+            "customer_type": "subscription",
+            "name": f"Bench Customer {index}",
+            "email": f"bench_{index}@example.com",
+            "phone_number": f"+1555{index:07d}",
+            "date_of_birth": "1990-01-15",
+            "profile_completed": False,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for index in range(rows)
+    ]
+
+    def pydantic_path():
+        # What GET /api/customers did: build models, then let response_model
+        # validate and encode them again
+        models = [server.CustomerResponse(**customer) for customer in page]
+        validated = [server.CustomerResponse.model_validate(model.model_dump()) for model in models]
+        return JSONResponse(jsonable_encoder(validated)).body
+
+    def fast_path():
+        return ORJSONResponse(page).body
+
+    results = {}
+    for name, render in (("pydantic", pydantic_path), ("orjson", fast_path)):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            render()
+        results[f"{name}_us_per_row"] = (time.perf_counter() - started) / (repeat * rows) * 1_000_000
+    results["speedup"] = results["pydantic_us_per_row"] / results["orjson_us_per_row"]
+    return {"rows": rows, **results}
+
+
+def print_report(report: dict):
+    """Print a per-endpoint summary table"""
+    print(f"📊 {report['requests']} requests per endpoint, concurrency {report['concurrency']} ({report['backend']})")
+    print(f"{'endpoint':<10}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    for name, result in report["endpoints"].items():
+        print(
+            f"{name:<10}{result['throughput_rps']:>10.1f}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+            f"{result['p99_ms']:>10.2f}{result['max_ms']:>10.2f}{result['errors']:>8}"
+        )
+    if "serialization" in report:
+        result = report["serialization"]
+        print(
+            f"serialization of {result['rows']} rows: {result['pydantic_us_per_row']:.2f} us/row with Pydantic, "
+            f"{result['orjson_us_per_row']:.2f} us/row with orjson ({result['speedup']:.1f}x)"
+        )
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[str]:
+    """List endpoints whose p95 latency or throughput regressed by more than `threshold` percent"""
+    regressions = []
+    for name, result in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous:
+            continue
+        if previous["p95_ms"] and result["p95_ms"] > previous["p95_ms"] * (1 + threshold / 100):
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.2f} ms -> {result['p95_ms']:.2f} ms")
+        if previous["throughput_rps"] and result["throughput_rps"] < previous["throughput_rps"] * (1 - threshold / 100):
+            regressions.append(
+                f"{name}: throughput {previous['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} rps"
+            )
+    return regressions
+
+
+def main():
+    """Main benchmark execution"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight at once")
+    parser.add_argument("--mongo-url", help="local mongod to use instead of mongomock-motor")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON report")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=20.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    benchmark = BirthdayClubBenchmark(args.requests, args.concurrency, args.mongo_url)
+    report = asyncio.run(benchmark.run())
+    report["serialization"] = serialization_benchmark()
+    print_report(report)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"🔧 Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print("❌ Regressions against baseline:")
+            for regression in regressions:
+                print(f"   {regression}")
+            return 1
+        print("✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,6 +16,7 @@ class BirthdayClubAPITester:
         self.tests_run = 0
         self.tests_passed = 0
         self.created_customers = []  # Track created customers for cleanup
+        self.phone_numbers = {}  # Account number -> signup phone (unique per customer)
         
     def log_test(self, test_name: str, success: bool, details: str = ""):
         """Log test results"""
@@ -64,9 +65,10 @@ class BirthdayClubAPITester:
     def test_customer_signup(self, customer_type: str) -> Optional[str]:
         """Test customer signup and return account number if successful"""
         timestamp = datetime.now().strftime("%H%M%S")
+        # Phone numbers and emails are unique per customer; signups run within the same second
         test_customer = {
             "name": f"Test Customer {customer_type} {timestamp}",
-            "phone_number": f"+1555{timestamp}",
+            "phone_number": f"+1555{len(self.phone_numbers)}{timestamp}",
             "email": f"test_{customer_type}_{timestamp}@example.com",
             "date_of_birth": "1990-01-15",  # Send as string
             "customer_type": customer_type
@@ -84,6 +86,7 @@ class BirthdayClubAPITester:
             
             if account_number and account_number.startswith(expected_prefix):
                 self.created_customers.append(account_number)
+                self.phone_numbers[account_number] = test_customer["phone_number"]
                 self.log_test(f"Customer Signup ({customer_type})", True, 
                             f"Account: {account_number}")
                 return account_number
@@ -104,7 +107,8 @@ class BirthdayClubAPITester:
             "contact_name": f"Profile Contact {timestamp}",
             "email_address": f"profile_{timestamp}@example.com",
             "employment_title": "Software Engineer",
-            "phone_number": f"+1555{timestamp}",
+            # Another customer's phone number would be rejected
+            "phone_number": self.phone_numbers[account_number],
             "birthday_date": "1990-01-15",  # Send as string
             "favorite_bistro_food_items": "Pasta, Pizza",
             "preferred_bistro_beverage": "Wine",
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
@@ -9,6 +9,9 @@ function App() {
   const [stats, setStats] = useState({});
   const [loading, setLoading] = useState(false);
   const [message, setMessage] = useState('');
+  // Signups and profile completions already applied, from this page's own
+  // requests or from the event stream (which may deliver them before or after)
+  const appliedWrites = useRef(new Set());
 
   // Fetch customers and stats
   const fetchData = async () => {
@@ -39,6 +42,70 @@ function App() {
     fetchData();
   }, []);
 
+  const applyStatsDelta = (delta) => {
+    setStats((previous) => {
+      const next = { ...previous };
+      Object.entries(delta).forEach(([field, change]) => {
+        next[field] = (next[field] || 0) + change;
+      });
+      next.profile_completion_rate = next.total_customers > 0
+        ? (next.completed_profiles / next.total_customers) * 100
+        : 0;
+      return next;
+    });
+  };
+
+  // True the first time a write is seen, false when it was already applied
+  const firstSeen = (key) => {
+    if (appliedWrites.current.delete(key)) {
+      return false;
+    }
+    appliedWrites.current.add(key);
+    if (appliedWrites.current.size > 1000) {
+      appliedWrites.current.delete(appliedWrites.current.values().next().value);
+    }
+    return true;
+  };
+
+  const applySignup = (customer, statsDelta) => {
+    setCustomers((previous) => [
+      customer,
+      ...previous.filter((c) => c.account_number !== customer.account_number),
+    ]);
+    applyStatsDelta(statsDelta);
+  };
+
+  // Apply other users' signups and profile completions as they happen
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') {
+      return undefined;
+    }
+    const events = new EventSource(`${BACKEND_URL}/api/events`);
+
+    events.addEventListener('signup', (e) => {
+      const { customer, stats_delta } = JSON.parse(e.data);
+      if (firstSeen(`signup:${customer.account_number}`)) {
+        applySignup(customer, stats_delta);
+      }
+    });
+
+    events.addEventListener('profile_completed', (e) => {
+      const { customer, stats_delta } = JSON.parse(e.data);
+      if (!firstSeen(`profile_completed:${customer.account_number}`)) {
+        return;
+      }
+      setCustomers((previous) => previous.map((c) => (
+        c.account_number === customer.account_number ? { ...c, ...customer } : c
+      )));
+      applyStatsDelta(stats_delta);
+    });
+
+    // The server could not resume the feed where it left off
+    events.addEventListener('reset', () => fetchData());
+
+    return () => events.close();
+  }, []);
+
   // Customer signup form
   const CustomerSignupForm = () => {
     const [formData, setFormData] = useState({
@@ -66,6 +133,11 @@ function App() {
         if (response.ok) {
           const customer = await response.json();
           setMessage(`✅ Welcome to Birthday Club! Your account number is: ${customer.account_number}`);
+          // Shown at once, whether or not this page's event stream carries it
+          if (firstSeen(`signup:${customer.account_number}`)) {
+            const typeField = `${customer.customer_type}_customers`;
+            applySignup(customer, { total_customers: 1, ...(typeField in stats ? { [typeField]: 1 } : {}) });
+          }
           setFormData({
             name: '',
             phone_number: '',
@@ -73,7 +145,6 @@ function App() {
             date_of_birth: '',
             customer_type: 'subscription'
           });
-          fetchData(); // Refresh data
         } else {
           const error = await response.json();
           setMessage(`❌ Error: ${error.detail}`);
@@ -194,6 +265,9 @@ function App() {
         if (response.ok) {
           const customer = await response.json();
           setMessage(`✅ Profile completed! Your profile number is: ${customer.customer_profile_number}`);
+          // The refresh includes it: skip the event if it comes later
+          firstSeen(`profile_completed:${customer.account_number}`);
+          fetchData(); // Refresh data
           setAccountNumber('');
           setProfileData({
             account_number: '',
@@ -218,7 +292,6 @@ function App() {
             i_like_surprises: false,
             special_notes: ''
           });
-          fetchData(); // Refresh data
         } else {
           const error = await response.json();
           setMessage(`❌ Error: ${error.detail}`);
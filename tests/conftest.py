@@ -0,0 +1,39 @@
+"""
+Shared fixtures: server.py imported in-process and pointed at a fresh
+mongomock-motor database for every test
+"""
+
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """An empty database, and counters with no block reserved yet"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client.birthday_club_test)
+    monkeypatch.setattr(server, "sequences", server.SequenceAllocator())
+    return server.db
+
+
+@pytest.fixture
+async def api(db):
+    """HTTP client calling the app in-process"""
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        yield http
@@ -0,0 +1,20 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_cross_origin_clients_can_read_the_next_cursor(api):
+    await server.db.customers.insert_many([
+        {"id": f"customer-{index}", "account_number": f"SAN-{index:05d}", "customer_type": "subscription",
+         "name": f"Customer {index}", "profile_completed": False,
+         "created_at": server.datetime(2026, 3, 10, 12, index), "updated_at": server.datetime(2026, 3, 10)}
+        for index in range(3)
+    ])
+
+    response = await api.get("/api/customers", params={"limit": 2}, headers={"Origin": "https://club.example.com"})
+
+    assert response.headers["X-Next-Cursor"]
+    exposed = {header.strip().lower() for header in response.headers["Access-Control-Expose-Headers"].split(",")}
+    assert {"x-next-cursor", "server-timing"} <= exposed
@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_backfill_adds_missing_derived_fields(db):
+    await db.customers.insert_many([
+        {"account_number": "SAN-00001", "name": "Jose Martinez", "email": "jose@example.com", "phone_number": "+1 555 123 4567"},
+        {"account_number": "SAN-00002", "name": "Ana Lopez", "email": "ana@example.com", "phone_number": "+1 555 000 1111",
+         "search_keys": ["already"]},
+    ])
+
+    await server.backfill_derived_fields("search_keys", ["name", "email", "phone_number"], server.derived_search_fields)
+
+    first = await db.customers.find_one({"account_number": "SAN-00001"})
+    second = await db.customers.find_one({"account_number": "SAN-00002"})
+    assert "martinez" in first["search_keys"]
+    assert second["search_keys"] == ["already"]
+
+
+async def test_backfill_never_overwrites_a_write_made_meanwhile(db, monkeypatch):
+    await db.customers.insert_one({"account_number": "SAN-00001", "date_of_birth": datetime(1990, 1, 15)})
+    collection = type(db.customers)
+    bulk_write = collection.bulk_write
+    writes = []
+
+    async def profile_completed_meanwhile(self, operations, **kwargs):
+        if not writes:
+            # Lands between the backfill's read and its write
+            writes.append(await self.update_one(
+                {"account_number": "SAN-00001"},
+                {"$set": {"birthday_date": datetime(1990, 6, 1)}},
+            ))
+        return await bulk_write(self, operations, **kwargs)
+
+    monkeypatch.setattr(collection, "bulk_write", profile_completed_meanwhile)
+
+    await server.backfill_derived_fields("birthday_md", ["date_of_birth", "birthday_date"], server.derived_birthday_fields)
+
+    # The stale value (115) was skipped and the next pass derived the fresh one
+    assert (await db.customers.find_one({"account_number": "SAN-00001"}))["birthday_md"] == 601
@@ -0,0 +1,73 @@
+from datetime import date
+
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize("start, days, ranges", [
+    (date(2026, 3, 10), 7, [(310, 316)]),
+    (date(2026, 3, 10), 1, [(310, 310)]),
+    # Split at the year end
+    (date(2026, 12, 28), 7, [(1228, 1231), (101, 103)]),
+    (date(2026, 12, 31), 1, [(1231, 1231)]),
+    (date(2026, 12, 31), 2, [(1231, 1231), (101, 101)]),
+    # A whole year or more covers every day once
+    (date(2026, 1, 1), 366, [(101, 1231)]),
+    (date(2026, 6, 15), 400, [(615, 1231), (101, 614)]),
+])
+def test_birthday_ranges(start, days, ranges):
+    assert server.birthday_ranges(start, days) == ranges
+
+
+def test_window_ending_feb_28_of_common_year_includes_feb_29():
+    assert server.birthday_ranges(date(2027, 2, 20), 9) == [(220, 229)]
+    # Across the year end too
+    assert server.birthday_ranges(date(2026, 12, 20), 71) == [(1220, 1231), (101, 229)]
+
+
+def test_window_ending_feb_28_of_leap_year_leaves_feb_29_out():
+    assert server.birthday_ranges(date(2028, 2, 20), 9) == [(220, 228)]
+
+
+def test_window_starting_march_1_of_common_year_leaves_feb_29_out():
+    # Their birthday was celebrated the day before
+    assert server.birthday_ranges(date(2027, 3, 1), 7) == [(301, 307)]
+
+
+@pytest.mark.parametrize("month_day, start, birthday", [
+    (615, date(2026, 3, 10), date(2026, 6, 15)),
+    (310, date(2026, 3, 10), date(2026, 3, 10)),
+    # Already passed this year
+    (105, date(2026, 3, 10), date(2027, 1, 5)),
+    (101, date(2026, 12, 28), date(2027, 1, 1)),
+    # Feb 29 is Feb 28 outside leap years
+    (229, date(2028, 2, 1), date(2028, 2, 29)),
+    (229, date(2027, 2, 1), date(2027, 2, 28)),
+    (229, date(2027, 3, 1), date(2028, 2, 29)),
+    (229, date(2026, 3, 1), date(2027, 2, 28)),
+])
+def test_next_birthday(month_day, start, birthday):
+    assert server.next_birthday(month_day, start) == birthday
+
+
+def test_birthday_month_day_reads_stored_and_parsed_dates():
+    assert server.birthday_month_day("1990-01-15") == 115
+    assert server.birthday_month_day(date(1992, 2, 29)) == 229
+    assert server.birthday_month_day(server.stored_date(date(1985, 12, 31))) == 1231
+
+
+@pytest.mark.anyio
+async def test_upcoming_birthdays_in_calendar_order_across_the_year_end(db):
+    await db.customers.insert_many([
+        {"account_number": f"SAN-{index:05d}", "birthday_md": month_day}
+        for index, month_day in enumerate([105, 1230, 229, 101, 1227, 1231, 610], start=1)
+    ])
+
+    customers = [customer async for customer in server.upcoming_birthdays(date(2026, 12, 28), 71)]
+    assert [customer["account_number"] for customer in customers] == [
+        "SAN-00002", "SAN-00006", "SAN-00004", "SAN-00001", "SAN-00003",
+    ]
+
+    limited = [customer async for customer in server.upcoming_birthdays(date(2026, 12, 28), 71, limit=3)]
+    assert [customer["account_number"] for customer in limited] == ["SAN-00002", "SAN-00006", "SAN-00004"]
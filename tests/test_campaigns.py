@@ -0,0 +1,123 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+START = date(2026, 3, 10)
+
+
+class FailingSender:
+    async def send(self, recipient, message):
+        raise ConnectionError("gateway unavailable")
+
+
+async def add_customer(account_number, contact_method):
+    await server.db.customers.insert_one({
+        "account_number": account_number,
+        "customer_profile_number": None,
+        "customer_type": "subscription",
+        "name": "Jose Martinez",
+        "birthday_md": 312,
+        "profile_completed": True,
+        "interest_in_rewards": True,
+        "preferred_contact_method": contact_method,
+    })
+
+
+def sent_to(scheduler, channel):
+    return [message["account_number"] for message in scheduler.senders[channel].sent]
+
+
+@pytest.mark.parametrize("contact_method, channel", [
+    ("email", "email"),
+    ("text", "sms"),
+    ("phone", "phone"),
+    ("whatsapp", "whatsapp"),
+    ("carrier pigeon", "email"),
+    (None, "email"),
+])
+async def test_every_contact_method_of_the_profile_form_has_a_sender(db, contact_method, channel):
+    await add_customer("SAN-00001", contact_method)
+    scheduler = server.CampaignScheduler()
+
+    result = await scheduler.run_once(START)
+
+    assert (result["sent"], result["failed"]) == (1, 0)
+    assert sent_to(scheduler, channel) == ["SAN-00001"]
+
+
+async def test_failed_deliveries_are_retried_by_the_next_run(db):
+    await add_customer("SAN-00001", "text")
+    scheduler = server.CampaignScheduler()
+    stub = scheduler.senders["sms"]
+    scheduler.senders["sms"] = FailingSender()
+
+    assert (await scheduler.run_once(START))["failed"] == 1
+
+    scheduler.senders["sms"] = stub
+    result = await scheduler.run_once(START)
+
+    assert (result["sent"], result["skipped"]) == (1, 0)
+    delivery = await db.campaign_deliveries.find_one({"account_number": "SAN-00001"})
+    assert (delivery["status"], delivery["attempts"]) == ("sent", 2)
+    # Sent deliveries are never claimed again
+    assert (await scheduler.run_once(START))["skipped"] == 1
+    assert sent_to(scheduler, "sms") == ["SAN-00001"]
+
+
+async def test_failed_deliveries_stop_after_max_attempts(db):
+    await add_customer("SAN-00001", "email")
+    scheduler = server.CampaignScheduler()
+    scheduler.senders["email"] = FailingSender()
+
+    results = [await scheduler.run_once(START) for _ in range(server.CAMPAIGN_MAX_ATTEMPTS + 1)]
+
+    assert [result["failed"] for result in results] == [1] * server.CAMPAIGN_MAX_ATTEMPTS + [0]
+    assert results[-1]["skipped"] == 1
+
+
+async def test_only_stale_pending_claims_are_taken_over(db):
+    await add_customer("SAN-00001", "email")
+    await add_customer("SAN-00002", "email")
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=server.CAMPAIGN_CLAIM_TIMEOUT_SECONDS + 60)
+    await db.campaign_deliveries.insert_many([
+        # Left behind by a run that crashed
+        {"_id": "2026:SAN-00001", "status": "pending", "claimed_at": stale, "attempts": 1},
+        # Being sent by a run in progress
+        {"_id": "2026:SAN-00002", "status": "pending", "claimed_at": now, "attempts": 1},
+    ])
+    scheduler = server.CampaignScheduler()
+
+    result = await scheduler.run_once(START)
+
+    assert (result["sent"], result["skipped"]) == (1, 1)
+    assert sent_to(scheduler, "email") == ["SAN-00001"]
+
+
+
+async def test_scheduler_survives_a_failing_state_read(db, monkeypatch):
+    reads = []
+    blocked = asyncio.Event()
+
+    async def find_one(self, *args, **kwargs):
+        reads.append(args)
+        if len(reads) == 1:
+            raise server.PyMongoError("not primary")
+        await blocked.wait()
+
+    monkeypatch.setattr(type(db.campaign_state), "find_one", find_one)
+    monkeypatch.setattr(server, "CAMPAIGN_INTERVAL_SECONDS", 0)
+    scheduler = server.CampaignScheduler()
+    scheduler.start()
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    # Logged, waited for and read again instead of ending the task
+    assert len(reads) == 2
+    assert not scheduler.task.done()
+    await scheduler.stop()
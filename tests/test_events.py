@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_stream_ends_after_its_longest_lifetime(monkeypatch):
+    monkeypatch.setattr(server, "EVENT_KEEPALIVE_SECONDS", 0.01)
+    monkeypatch.setattr(server, "EVENT_STREAM_MAX_SECONDS", 0.05)
+    feed = server.EventFeed()
+    feed.source = "memory"
+
+    events = [event async for event in feed.events(None)]
+
+    assert events and all(event is None for event in events)
+    # The subscription is released, not left behind for the broker to fill
+    assert not feed.broker.subscribers
+
+
+async def test_stream_replays_missed_events_before_ending(monkeypatch):
+    monkeypatch.setattr(server, "EVENT_STREAM_MAX_SECONDS", 0)
+    feed = server.EventFeed()
+    feed.source = "memory"
+    feed.publish("signup", {"account_number": "SAN-00001"}, {"total_customers": 1})
+    feed.publish("signup", {"account_number": "SAN-00002"}, {"total_customers": 1})
+    first_id = feed.broker.buffer[0][1]["id"]
+
+    events = [event async for event in feed.events(first_id)]
+
+    # Ends at the first event past the deadline; the client resumes from its id
+    assert [event["data"]["customer"]["account_number"] for event in events] == ["SAN-00002"]
+    assert not feed.broker.subscribers
+
+
+async def test_close_ends_open_streams():
+    feed = server.EventFeed()
+    feed.source = "memory"
+    stream = feed.events(None)
+    pending = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0)
+    feed.publish("signup", {"account_number": "SAN-00001"}, {"total_customers": 1})
+    assert (await pending)["event"] == "signup"
+
+    feed.close()
+
+    assert [event async for event in stream] == []
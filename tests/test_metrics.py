@@ -0,0 +1,33 @@
+import sys
+import threading
+from types import SimpleNamespace
+
+import server
+
+
+def test_command_metrics_count_commands_completing_on_many_threads(monkeypatch):
+    monkeypatch.setattr(server, "command_metrics", {})
+    listener = server.MongoCommandListener()
+    event = SimpleNamespace(command_name="find", duration_micros=1000, request_id=0)
+    failure = SimpleNamespace(command_name="find", duration_micros=1000, request_id=0)
+    # Switch threads as often as possible to interleave the updates
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    def complete():
+        for _ in range(5000):
+            listener.succeeded(event)
+        listener.failed(failure)
+
+    try:
+        threads = [threading.Thread(target=complete) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    count, seconds, failures = server.command_metrics["find"]
+    assert (count, failures) == (8 * 5001, 8)
+    assert abs(seconds - 8 * 5001 / 1000) < 1e-6
@@ -0,0 +1,94 @@
+from datetime import date, datetime
+
+import pytest
+
+import server
+
+UPDATED_AT = datetime(2025, 1, 1, 12, 0)
+
+
+def make_profile(**fields) -> server.CustomerProfile:
+    return server.CustomerProfile(**{
+        "account_number": "SAN-00001",
+        "contact_name": "Jose Martinez",
+        "email_address": "jose@example.com",
+        "phone_number": "+1 555 123 4567",
+        "birthday_date": date(1990, 1, 15),
+        "celebration_budget": "100_200",
+        "preferred_contact_method": "email",
+        "interest_in_rewards": True,
+        **fields,
+    })
+
+
+async def add_completed_customer(profile: server.CustomerProfile):
+    profile_data = server.profile_field_values(profile)
+    await server.db.customers.insert_one({
+        "account_number": "SAN-00001",
+        "customer_profile_number": "SCPN-00001",
+        "profile_completed": True,
+        "created_at": UPDATED_AT,
+        "updated_at": UPDATED_AT,
+        **profile_data,
+        "profile_search_keys": server.profile_search_keys(profile_data),
+        **server.contact_keys(None, profile_data["phone_number"]),
+    })
+
+
+def test_resubmission_update_keeps_updated_at_unless_a_field_differs():
+    now = datetime(2026, 3, 10)
+    update = server.profile_resubmission_update({"contact_name": "Jose", "phone_number": "555", "allergies": None}, now)
+
+    updated_at = update[0]["$set"]["updated_at"]["$cond"]
+    assert updated_at[1:] == ["$updated_at", now]
+    assert {"$eq": [{"$ifNull": ["$allergies", None]}, {"$literal": None}]} in updated_at[0]["$and"]
+
+
+def test_resubmission_update_removes_phone_key_without_digits():
+    update = server.profile_resubmission_update({"contact_name": "Jose", "phone_number": "n/a"}, datetime(2026, 3, 10))
+
+    assert update[0]["$set"]["phone_key"] == "$$REMOVE"
+
+
+@pytest.mark.anyio
+async def test_identical_resubmission_leaves_updated_at_unchanged(db):
+    await add_completed_customer(make_profile())
+
+    before, after = await server.resubmit_profile("SAN-00001", make_profile())
+
+    assert before["updated_at"] == after["updated_at"] == UPDATED_AT
+    assert (await db.customers.find_one({"account_number": "SAN-00001"}))["updated_at"] == UPDATED_AT
+
+
+@pytest.mark.anyio
+async def test_changed_resubmission_moves_updated_at(db):
+    await add_completed_customer(make_profile())
+
+    before, after = await server.resubmit_profile("SAN-00001", make_profile(allergies="peanuts"))
+
+    stored = await db.customers.find_one({"account_number": "SAN-00001"})
+    assert before["updated_at"] == UPDATED_AT
+    assert stored["updated_at"] == after["updated_at"] > UPDATED_AT
+    assert stored["allergies"] == "peanuts"
+    # The profile number is never redrawn
+    assert stored["customer_profile_number"] == "SCPN-00001"
+
+
+@pytest.mark.anyio
+async def test_resubmission_refreshes_derived_keys(db):
+    await add_completed_customer(make_profile())
+
+    await server.resubmit_profile("SAN-00001", make_profile(contact_name="Ana Lopez", phone_number="+1 555 000 1111"))
+
+    stored = await db.customers.find_one({"account_number": "SAN-00001"})
+    assert stored["phone_key"] == "15550001111"
+    assert "lopez" in stored["profile_search_keys"]
+    assert "martinez" not in stored["profile_search_keys"]
+
+
+@pytest.mark.anyio
+async def test_resubmission_skips_customers_without_a_profile(db):
+    await db.customers.insert_one({"account_number": "SAN-00001", "profile_completed": False, "updated_at": UPDATED_AT})
+
+    assert await server.resubmit_profile("SAN-00001", make_profile()) is None
+    assert await server.resubmit_profile("SAN-00404", make_profile()) is None
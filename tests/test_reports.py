@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import mongomock
+import pytest
+
+import reports
+
+
+@pytest.fixture
+def customers():
+    collection = mongomock.MongoClient().birthday_club_test.customers
+    collection.insert_many([
+        {
+            "id": f"customer-{index}",
+            "account_number": f"SAN-{index:05d}",
+            "customer_type": "subscription",
+            "date_of_birth": datetime(1990, 1, 15),
+            "birthday_md": 115,
+            "profile_completed": True,
+            "created_at": datetime(2026, 3, 10),
+            "updated_at": datetime(2026, 3, 10),
+            # Typed in by the customer: every value differs
+            "dietary_restrictions": f"no ingredient {index}",
+        }
+        for index in range(300)
+    ])
+    return collection
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".arrow"])
+def test_snapshot_keeps_hundreds_of_distinct_free_text_values(customers, tmp_path, suffix):
+    path = tmp_path / f"snapshot{suffix}"
+
+    assert reports.write_snapshot(customers, path, batch_size=1000) == 300
+
+    df = reports.read_snapshot(path, ["account_number", "dietary_restrictions"])
+    assert df["dietary_restrictions"].nunique() == 300
+    assert df.loc[df["account_number"] == "SAN-00299", "dietary_restrictions"].item() == "no ingredient 299"
@@ -0,0 +1,88 @@
+from datetime import date
+
+import pytest
+
+import server
+
+
+def test_search_keys_normalize_name_email_and_phone():
+    keys = server.search_keys("José  O'Brien", " Jose.OBrien@Example.COM ", "+1 (555) 123-4567")
+
+    assert {"jose", "o", "brien", "jose.obrien@example.com", "15551234567", "5551234567"} <= set(keys)
+    assert keys == sorted(keys)
+
+
+def test_search_keys_add_deletions_of_long_words_only():
+    keys = server.search_keys("Ana Maria", None, None)
+
+    assert {"~aria", "~mria", "~maia", "~mara", "~mari"} <= set(keys)
+    assert not any(key.startswith("~") and len(key) == 3 for key in keys)
+    assert server.search_keys(None, None, None) == []
+
+
+def fuzzy_keys(term):
+    """Keys the fuzzy search filter accepts for a term"""
+    return server.search_filter([term], fuzzy=True)["$or"][0]["$and"][0]["search_keys"]["$in"]
+
+
+@pytest.mark.parametrize("typo", ["martnez", "martinnez", "martinex", "martinez"])
+def test_one_typo_shares_a_deletion_key(typo):
+    stored = set(server.search_keys("Martinez", None, None))
+    query = set(fuzzy_keys(typo))
+
+    assert stored & query
+
+
+def test_two_typos_share_no_deletion_key():
+    stored = set(server.search_keys("Martinez", None, None))
+    typo = "mrtnez"
+    query = set(fuzzy_keys(typo))
+
+    assert not stored & query
+
+
+@pytest.mark.parametrize("query, terms", [
+    ("Jose Martinez", ["jose", "martinez"]),
+    ("JOSÉ", ["jose"]),
+    ("Jose.OBrien@Example.com", ["jose.obrien@example.com"]),
+    # A phone number typed with spaces is one term
+    ("+1 555 123 4567", ["15551234567"]),
+    ("(555) 123-4567", ["5551234567"]),
+    ("jose 555-1234", ["jose", "5551234"]),
+    ("  ", []),
+])
+def test_search_terms(query, terms):
+    assert server.search_terms(query) == terms
+
+
+def test_fuzzy_filter_only_for_long_alphabetic_terms():
+    exact = server.search_filter(["jo", "5551234", "martnez"], fuzzy=True)["$or"][0]["$and"]
+
+    assert exact[0] == {"search_keys": {"$regex": "^jo"}}
+    assert exact[1] == {"search_keys": {"$regex": "^5551234"}}
+    assert "~martnez" in exact[2]["search_keys"]["$in"]
+
+
+async def add_customer(account_number, name, email, phone_number):
+    customer = server.CustomerSignup(
+        name=name,
+        email=email,
+        phone_number=phone_number,
+        date_of_birth=date(1990, 1, 15),
+        customer_type="subscription",
+    )
+    await server.db.customers.insert_one(server.build_customer_document(customer, account_number))
+
+
+@pytest.mark.anyio
+async def test_search_customers_finds_prefixes_then_typos(db):
+    await add_customer("SAN-00001", "Jose Martinez", "jose@example.com", "+1 555 123 4567")
+    await add_customer("SAN-00002", "Maria Martins", "maria@example.com", "+1 555 987 6543")
+    await add_customer("SAN-00003", "Peter Smith", "peter@example.com", "+44 20 7946 0000")
+
+    assert [c["account_number"] for c in await server.search_customers("mart", 10)] == ["SAN-00001", "SAN-00002"]
+    assert [c["account_number"] for c in await server.search_customers("Martnez", 10)] == ["SAN-00001"]
+    assert [c["account_number"] for c in await server.search_customers("555 987 6543", 10)] == ["SAN-00002"]
+    assert [c["account_number"] for c in await server.search_customers("PETER@example.com", 10)] == ["SAN-00003"]
+    assert await server.search_customers("Smyth Peter Jones", 10) == []
+    assert "search_keys" not in (await server.search_customers("jose", 10))[0]
@@ -0,0 +1,22 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_segment_counts_are_recounted_on_the_primary(db, monkeypatch):
+    await db.customers.insert_many([
+        {"account_number": f"SAN-{index:05d}", "profile_completed": True, "celebration_budget": "100_200"}
+        for index in range(3)
+    ])
+    # Reads that may go to a secondary see none of them yet
+    monkeypatch.setattr(server, "read_customers", lambda: db.lagging_customers)
+    conditions = {"celebration_budget": "100_200"}
+    counts = server.SegmentCounts()
+
+    assert await counts.count(conditions) == (3, "computed")
+
+    # Later writes move the stored count from there
+    await counts.apply_change(None, {"profile_completed": True, "celebration_budget": "100_200"})
+    assert await counts.count(conditions) == (4, "tracked")
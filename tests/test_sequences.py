@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def insert_customers(db, account_numbers):
+    await db.customers.insert_many([{"account_number": number} for number in account_numbers])
+
+
+async def test_seed_starts_after_highest_issued_number(db):
+    await insert_customers(db, [f"SAN-{count:05d}" for count in range(1, 11)])
+    # Deleted customers leave gaps: 5 remain but SAN-00010 is still in use
+    await db.customers.delete_many({"account_number": {"$lte": "SAN-00005"}})
+
+    await server.seed_sequences()
+
+    assert await server.get_next_account_number("subscription") == "SAN-00011"
+
+
+async def test_seed_reads_numbers_past_five_digits(db):
+    await insert_customers(db, ["SAN-99999", "SAN-100002", "SAN-00007"])
+
+    await server.seed_sequences()
+
+    assert await server.get_next_account_number("subscription") == "SAN-100003"
+
+
+async def test_seed_keeps_prefixes_apart(db):
+    # "^SAN-" must not match NSAN or CSAN numbers
+    await insert_customers(db, ["NSAN-00040", "CSAN-00030", "SAN-00002"])
+
+    await server.seed_sequences()
+
+    assert await server.get_next_account_number("subscription") == "SAN-00003"
+    assert await server.get_next_account_number("non_subscription") == "NSAN-00041"
+    assert await server.get_next_account_number("corporate") == "CSAN-00031"
+    assert await server.get_next_account_number("unknown") == "GEN-00001"
+
+
+async def test_seed_covers_profile_numbers(db):
+    await db.customers.insert_many([
+        {"account_number": "SAN-00001", "customer_profile_number": "SCPN-00009"},
+        {"account_number": "SAN-00002", "customer_profile_number": None},
+    ])
+
+    await server.seed_sequences()
+
+    assert await server.get_next_profile_number("subscription") == "SCPN-00010"
+
+
+async def test_seed_leaves_existing_counters_alone(db):
+    await insert_customers(db, ["SAN-00010"])
+    await db.counters.insert_one({"_id": server.account_counter_name("subscription"), "seq": 42})
+
+    await server.seed_sequences()
+
+    counter = await db.counters.find_one({"_id": server.account_counter_name("subscription")})
+    assert counter["seq"] == 42
+
+
+async def test_seed_never_moves_a_counter_backwards(db):
+    await db.counters.insert_one({"_id": "account_number:SAN", "seq": 42})
+
+    await server.sequences.seed("account_number:SAN", 10)
+
+    assert (await db.counters.find_one({"_id": "account_number:SAN"}))["seq"] == 42
+
+
+async def test_reserve_returns_first_of_consecutive_numbers(db):
+    allocator = server.SequenceAllocator()
+
+    assert await allocator.reserve("test", 5) == 1
+    assert await allocator.reserve("test", 3) == 6
+    assert await allocator.reserve("test") == 9
+
+
+async def test_block_allocation_is_consecutive_within_a_process(db):
+    allocator = server.SequenceAllocator(block_size=5)
+
+    values = [await allocator.next("test") for _ in range(12)]
+
+    assert values == list(range(1, 13))
+    # Three blocks reserved, the rest of the last one stays in memory
+    assert (await db.counters.find_one({"_id": "test"}))["seq"] == 15
+
+
+async def test_concurrent_allocation_never_repeats_a_number(db):
+    allocator = server.SequenceAllocator(block_size=4)
+
+    values = await asyncio.gather(*[allocator.next("test") for _ in range(20)])
+
+    assert sorted(values) == list(range(1, 21))
+
+
+async def test_allocators_of_several_processes_get_disjoint_blocks(db):
+    workers = [server.SequenceAllocator(block_size=10) for _ in range(3)]
+
+    values = await asyncio.gather(*[workers[index % 3].next("test") for index in range(45)])
+
+    assert len(set(values)) == 45
+    # Leftovers of reserved blocks are skipped, never handed out twice
+    assert max(values) <= (await db.counters.find_one({"_id": "test"}))["seq"]
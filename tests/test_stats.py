@@ -0,0 +1,45 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def lagging_secondary(db, monkeypatch):
+    """List and stats reads go to a secondary that has not seen the customers yet"""
+    await db.customers.insert_many([
+        {"account_number": "SAN-00001", "customer_type": "subscription", "profile_completed": True},
+        {"account_number": "CSAN-00001", "customer_type": "corporate", "profile_completed": False},
+    ])
+    monkeypatch.setattr(server, "read_customers", lambda: db.lagging_customers)
+
+
+async def test_materialized_stats_are_seeded_from_the_primary(api, lagging_secondary):
+    stats = (await api.get("/api/stats", params={"source": "materialized"})).json()
+
+    assert (stats["total_customers"], stats["completed_profiles"], stats["corporate_customers"]) == (2, 1, 1)
+    # Live stats may still be served by the secondary
+    assert (await api.get("/api/stats", params={"source": "live"})).json()["total_customers"] == 0
+
+
+async def test_repair_recounts_on_the_primary(api, lagging_secondary):
+    await api.get("/api/stats")
+
+    repair = (await api.post("/api/stats/repair")).json()
+    check = (await api.get("/api/stats/check")).json()
+
+    assert not repair["repaired"]
+    assert check["consistent"]
+    assert (await server.db.stats.find_one({"_id": server.STATS_DOCUMENT_ID}))["total_customers"] == 2
+
+
+async def test_repair_corrects_drift_with_an_increment(api, db):
+    await db.customers.insert_one({"account_number": "SAN-00001", "customer_type": "subscription"})
+    await api.get("/api/stats")
+    await db.stats.update_one({"_id": server.STATS_DOCUMENT_ID}, {"$inc": {"total_customers": 3}})
+
+    repair = (await api.post("/api/stats/repair")).json()
+
+    assert repair["drift"] == {"total_customers": 3}
+    assert (await api.get("/api/stats/check")).json()["consistent"]